@@ -1,5 +1,6 @@
 import cv2
 import os
+from detectors import HaarDetector
 
 def extract_and_detect_frame(video_path, frame_number, output_folder="debug", cascade_path="haarcascade_frontalface_default.xml"):
     """
@@ -13,7 +14,7 @@ def extract_and_detect_frame(video_path, frame_number, output_folder="debug", ca
         cascade_path (str): Path to the Haar Cascade XML file for face detection.
     """
     # Load the Haar cascade for face detection
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + cascade_path)
+    detector = HaarDetector(cascade_path)
 
     # Open the video file
     cap = cv2.VideoCapture(video_path)
@@ -36,15 +37,13 @@ def extract_and_detect_frame(video_path, frame_number, output_folder="debug", ca
         cap.release()
         return
 
-    # Convert to grayscale for face detection
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
     # Detect faces
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+    faces = detector.detect_frame(frame)
 
     # Draw bounding boxes around detected faces
-    for (x, y, w, h) in faces:
-        cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
+    for face in faces:
+        x, y, w, h = face["x"], face["y"], face["width"], face["height"]
+        cv2.rectangle(frame, (x, y), (x + w, y + h), detector.color, 2)
 
     # Create output folder if it doesn't exist
     if not os.path.exists(output_folder):
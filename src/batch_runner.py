@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import argparse
+from tqdm import tqdm
+from detectors import create_detector, worker_context, worker_threads
+from gallery import load_gallery
+from pipeline import add_pipeline_arguments, run_pipeline
+
+# Written to an entry's output directory once it has been processed; entries that have it are skipped
+RESULT_FILE = "batch_result.json"
+
+
+def load_manifest(manifest_path):
+    """
+    Load a batch manifest: a JSON list of entries with "video_path", "output_dir" and either
+    "reference_image_path" (one path or a list) or "gallery_dir".
+    """
+    with open(manifest_path, "r") as file:
+        entries = json.load(file)
+    for i, entry in enumerate(entries):
+        missing = [key for key in ("video_path", "output_dir") if key not in entry]
+        if "reference_image_path" not in entry and "gallery_dir" not in entry:
+            missing.append("reference_image_path or gallery_dir")
+        if missing:
+            raise ValueError(f"Manifest entry {i} is missing {', '.join(missing)}")
+    return entries
+
+
+def is_done(entry):
+    return os.path.exists(os.path.join(entry["output_dir"], RESULT_FILE))
+
+
+_batch_worker = {}
+
+
+def _init_batch_worker(algorithm, cascade_path, num_threads, options):
+    # Models are loaded once per process and reused for every video it processes
+    start = time.perf_counter()
+    _batch_worker["detector"] = create_detector(algorithm, cascade_path, num_threads)
+    _batch_worker["options"] = options
+    _batch_worker["galleries"] = {}  # Reference images -> FaceGallery, as many entries share a target
+    _batch_worker["load_seconds"] = time.perf_counter() - start
+
+
+def _worker_gallery(entry):
+    reference_image_path = entry.get("reference_image_path")
+    if isinstance(reference_image_path, str):
+        reference_image_path = [reference_image_path]
+    key = (entry.get("gallery_dir"), tuple(reference_image_path or ()))
+    galleries = _batch_worker["galleries"]
+    if key not in galleries:
+        galleries[key] = load_gallery(entry.get("gallery_dir"), reference_image_path)
+    return galleries[key]
+
+
+def _run_entry(entry):
+    result = {"video_path": entry["video_path"], "output_dir": entry["output_dir"], "worker": os.getpid(),
+              "model_load_seconds": _batch_worker["load_seconds"]}
+    start = time.perf_counter()
+    # A result of an earlier run must not mark this entry as done if it fails now
+    if is_done(entry):
+        os.remove(os.path.join(entry["output_dir"], RESULT_FILE))
+    try:
+        gallery = _worker_gallery(entry)
+        gallery_seconds = time.perf_counter() - start
+        stats = run_pipeline(entry["video_path"], entry.get("reference_image_path"), entry["output_dir"],
+                             gallery_dir=entry.get("gallery_dir"), detector=_batch_worker["detector"], gallery=gallery,
+                             **_batch_worker["options"])
+    except Exception as error:
+        result.update({"status": "failed", "error": f"{type(error).__name__}: {error}", "seconds": time.perf_counter() - start})
+        return result
+
+    seconds = time.perf_counter() - start
+    if stats is None:
+        result.update({"status": "failed", "error": "The video or reference images could not be processed.", "seconds": seconds})
+        return result
+
+    result.update({"status": "done", "seconds": seconds, "gallery_seconds": gallery_seconds, "frames": stats["frames"],
+                   "fps": stats["frames"] / seconds if seconds > 0 else 0.0, "segments": stats["segments"]})
+    with open(os.path.join(entry["output_dir"], RESULT_FILE), "w") as file:
+        json.dump(result, file, indent=4)
+    return result
+
+
+def run_batch(manifest_path, summary_path, algorithm="retinaface", cascade_path="haarcascade_frontalface_default.xml",
+              workers=1, force=False, **options):
+    """
+    Run the single-pass pipeline (see pipeline.py) on every entry of a manifest with a pool of worker processes.
+
+    Each worker loads the face detector once and keeps the galleries it has built, so a video only
+    pays for its own decode and processing. Entries whose output directory holds a batch_result.json
+    from an earlier run are skipped, so an interrupted batch can simply be restarted.
+
+    Args:
+        manifest_path (str): Path to the manifest (see load_manifest).
+        summary_path (str): Where to save the summary with the result and timings of every entry.
+        algorithm (str): The face detection algorithm to use ("haar" or "retinaface").
+        cascade_path (str): Path to the Haar Cascade XML file (used with Haar algorithm).
+        workers (int): Number of worker processes. 1 runs the entries in this process.
+        force (bool): If True, also rerun the entries that are already done.
+        **options: Further keyword arguments of pipeline.run_pipeline, e.g. match_threshold or backend.
+
+    Returns:
+        dict: The summary.
+    """
+    start = time.perf_counter()
+    entries = load_manifest(manifest_path)
+    results = []
+    pending = []
+    for entry in entries:
+        if not force and is_done(entry):
+            results.append({"video_path": entry["video_path"], "output_dir": entry["output_dir"], "status": "skipped"})
+        else:
+            pending.append(entry)
+    print(f"{len(pending)} of {len(entries)} videos to process ({len(entries) - len(pending)} already done).")
+
+    num_threads = worker_threads(workers)
+    initargs = (algorithm, cascade_path, num_threads, options)
+    if pending and workers <= 1:
+        _init_batch_worker(*initargs)
+        results += [_run_entry(entry) for entry in tqdm(pending, desc="Videos", unit="video")]
+    elif pending:
+        with worker_context().Pool(workers, initializer=_init_batch_worker, initargs=initargs) as pool:
+            results += list(tqdm(pool.imap_unordered(_run_entry, pending), total=len(pending), desc=f"Videos ({workers} workers)", unit="video"))
+
+    for result in results:
+        if result["status"] == "failed":
+            print(f"Error: {result['video_path']}: {result['error']}")
+
+    processed = [result for result in results if result["status"] == "done"]
+    summary = {
+        "manifest": os.path.abspath(manifest_path),
+        "workers": workers,
+        "total_seconds": time.perf_counter() - start,
+        "counts": {status: sum(result["status"] == status for result in results) for status in ("done", "skipped", "failed")},
+        "frames": sum(result["frames"] for result in processed),
+        "model_load_seconds": {str(pid): seconds for pid, seconds in
+                               sorted({result["worker"]: result["model_load_seconds"] for result in results if "worker" in result}.items())},
+        "entries": results,
+    }
+    if os.path.dirname(summary_path):
+        os.makedirs(os.path.dirname(summary_path), exist_ok=True)
+    with open(summary_path, "w") as file:
+        json.dump(summary, file, indent=4)
+    print(f"Processed {summary['counts']['done']} videos, skipped {summary['counts']['skipped']}, "
+          f"{summary['counts']['failed']} failed in {summary['total_seconds']:.1f} s. Summary saved to: {summary_path}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect, recognize and crop target faces in many videos with a shared pool of loaded models.")
+    parser.add_argument("--manifest", type=str, required=True, help="JSON list of {video_path, reference_image_path or gallery_dir, output_dir} entries.")
+    parser.add_argument("--summary_path", type=str, default="batch_summary.json", help="Where to save the per-video results and timings.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes, each with its own models.")
+    parser.add_argument("--force", action="store_true", help="Also rerun the videos whose outputs already exist.")
+    add_pipeline_arguments(parser)
+
+    args = parser.parse_args()
+    if args.audio and args.backend != "ffmpeg":
+        parser.error("--audio requires --backend ffmpeg")
+
+    run_batch(
+        manifest_path=args.manifest,
+        summary_path=args.summary_path,
+        algorithm=args.algorithm,
+        cascade_path=args.cascade_path,
+        workers=args.workers,
+        force=args.force,
+        match_threshold=args.match_threshold,
+        save_coordinates=args.save_coordinates,
+        output_format=args.output_format,
+        batch_size=args.batch_size,
+        backend=args.backend,
+        audio=args.audio
+    )
+
+
+if __name__ == "__main__":
+    main()
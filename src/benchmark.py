@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import platform
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from face_detection import detect_faces_in_video
+from face_recog import process_video
+from face_store import load_face_coordinates
+from gallery import load_gallery
+from profiling import StageTimer
+from scene_detection import load_scene_cuts, scene_cuts_path
+from tracking import box_iou
+from evaluate_detection import compare_face_coordinates
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Reference image of the target of each sample output; the video is named in its metadata.json
+SAMPLE_REFERENCES = {
+    "bill_hard": "sample_data/bill_gates.png",
+    "jensen_medium1": "sample_data/jensen_huang.png",
+    "simon_easy": "sample_data/simon_alexander_ong.png",
+}
+
+
+def list_samples(sample_output_dir):
+    """
+    List the benchmark cases of the sample outputs whose video and reference image exist.
+
+    Returns:
+        list: Dicts with "name", "video_path", "reference_image_path" and "reference_dir".
+    """
+    samples = []
+    for name in sorted(os.listdir(sample_output_dir)):
+        reference_dir = os.path.join(sample_output_dir, name)
+        metadata_path = os.path.join(reference_dir, "videos", "metadata.json")
+        if name not in SAMPLE_REFERENCES or not os.path.exists(metadata_path):
+            continue
+        with open(metadata_path, "r") as file:
+            video_path = os.path.normpath(os.path.join(REPO_ROOT, json.load(file)["file_name"]))
+        reference_image_path = os.path.join(REPO_ROOT, SAMPLE_REFERENCES[name])
+        if not os.path.exists(video_path) or not os.path.exists(reference_image_path):
+            print(f"Skipping {name}: {video_path if not os.path.exists(video_path) else reference_image_path} not found.")
+            continue
+        samples.append({"name": name, "video_path": video_path, "reference_image_path": reference_image_path,
+                        "reference_dir": reference_dir})
+    return samples
+
+
+def compare_segments(metadata, reference_metadata, iou_threshold=0.5):
+    """
+    Compare the matched frames of a face_recog.py metadata.json against a reference one.
+
+    A matched frame is correct if the reference matched the same frame with a box of IoU at least `iou_threshold`.
+
+    Returns:
+        dict: Precision and recall of the matched frames, mean IoU of the correct ones, and both segment counts.
+    """
+    def frame_boxes(data):
+        return {frame_index: box for segment in data["segments"] for frame_index, box in segment["face_coordinates"]}
+
+    boxes, reference_boxes = frame_boxes(metadata), frame_boxes(reference_metadata)
+    ious = [box_iou(boxes[frame_index], reference_boxes[frame_index]) for frame_index in boxes.keys() & reference_boxes.keys()]
+    correct = [iou for iou in ious if iou >= iou_threshold]
+    return {
+        "precision": len(correct) / len(boxes) if boxes else 1.0,
+        "recall": len(correct) / len(reference_boxes) if reference_boxes else 1.0,
+        "mean_iou": sum(correct) / len(correct) if correct else 0.0,
+        "segments": len(metadata["segments"]),
+        "reference_segments": len(reference_metadata["segments"]),
+    }
+
+
+def stage_report(timer, seconds, frames):
+    """
+    Combine a StageTimer summary with the total time, the time outside any stage and the frame rate.
+    """
+    report = timer.summary()
+    report["seconds"] = seconds
+    report["other_seconds"] = seconds - sum(stage["seconds"] for stage in report["stages"].values())
+    report["fps"] = frames / seconds if seconds > 0 else 0.0
+    return report
+
+
+def run_case(sample, output_dir, detection_options, recognition_options, recognize_on):
+    """
+    Run face detection and recognition on one sample and return its timings, peak memory and accuracy.
+
+    Recognition runs on the reference face coordinates by default, so its accuracy does not depend on the detector.
+
+    Args:
+        sample (dict): The case, from list_samples.
+        output_dir (str): Directory for the outputs of the run.
+        detection_options (dict): Keyword arguments of face_detection.detect_faces_in_video.
+        recognition_options (dict): Keyword arguments of face_recog.process_video, e.g. match_threshold or track.
+        recognize_on (str): "reference" or "detected" face coordinates.
+    """
+    detection_dir = os.path.join(output_dir, "detection")
+    recognition_dir = os.path.join(output_dir, "recognition")
+
+    detection_timer = StageTimer()
+    start = time.perf_counter()
+    detect_faces_in_video(sample["video_path"], detection_dir, timer=detection_timer, **detection_options)
+    detection_seconds = time.perf_counter() - start
+    detection = stage_report(detection_timer, detection_seconds, detection_timer.counters.get("frames", 0))
+
+    recognition_timer = StageTimer()
+    start = time.perf_counter()
+    with recognition_timer.stage("io"):
+        reference_coordinates = load_face_coordinates(os.path.join(sample["reference_dir"], "face_coordinates.json"))
+        detected_coordinates = load_face_coordinates(os.path.join(detection_dir, "face_coordinates"))
+    with recognition_timer.stage("load_models"):
+        gallery = load_gallery(None, [sample["reference_image_path"]])
+    if recognize_on == "reference":
+        face_coordinates, scene_cuts = reference_coordinates, None
+    else:
+        face_coordinates, scene_cuts = detected_coordinates, load_scene_cuts(scene_cuts_path(os.path.join(detection_dir, "face_coordinates")))
+    process_video(sample["video_path"], face_coordinates, gallery, recognition_dir, debug=False, scene_cuts=scene_cuts,
+                  timer=recognition_timer, **recognition_options)
+    recognition_seconds = time.perf_counter() - start
+    recognition = stage_report(recognition_timer, recognition_seconds, len(face_coordinates))
+    recognition["embeddings_per_frame"] = recognition_timer.counters.get("embeddings", 0) / max(len(face_coordinates), 1)
+
+    with open(os.path.join(recognition_dir, "metadata.json"), "r") as file:
+        metadata = json.load(file)
+    with open(os.path.join(sample["reference_dir"], "videos", "metadata.json"), "r") as file:
+        reference_metadata = json.load(file)
+
+    return {
+        "name": sample["name"],
+        "video_path": os.path.relpath(sample["video_path"], REPO_ROOT),
+        "frames": detection_timer.counters.get("frames", 0),
+        "detection": detection,
+        "recognition": recognition,
+        # ru_maxrss is in kilobytes on Linux; each case runs in its own process. The detection workers of --workers
+        # and ffmpeg are its child processes, whose largest peak is reported separately
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_child_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        "accuracy": {
+            "detection": compare_face_coordinates(list(detected_coordinates), list(reference_coordinates)),
+            "recognition": compare_segments(metadata, reference_metadata),
+        },
+    }
+
+
+def git_commit():
+    """
+    Return (commit hash, whether the working tree has uncommitted changes), or (None, None) outside a git repository.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def print_report(results, baseline=None):
+    """
+    Print the cases as a markdown table, with the speedup and accuracy change against a baseline results file.
+    """
+    baseline_cases = {case["name"]: case for case in baseline["cases"]} if baseline else {}
+    print("| video | detection fps | recognition fps | embeddings/frame | peak RSS (MB), child | detection P/R | recognition P/R | segments |")
+    print("|---|---|---|---|---|---|---|---|")
+    for case in results["cases"]:
+        detection, recognition = case["accuracy"]["detection"], case["accuracy"]["recognition"]
+        row = (f"| {case['name']} | {case['detection']['fps']:.1f} | {case['recognition']['fps']:.1f} | "
+               f"{case['recognition']['embeddings_per_frame']:.2f} | {case['peak_rss_mb']:.0f}, {case['peak_child_rss_mb']:.0f} | "
+               f"{detection['precision']:.3f}/{detection['recall']:.3f} | {recognition['precision']:.3f}/{recognition['recall']:.3f} | "
+               f"{recognition['segments']} ({recognition['reference_segments']} in reference) |")
+        print(row)
+
+    for case in results["cases"]:
+        print(f"\n{case['name']} stage times (s):")
+        for part in ("detection", "recognition"):
+            stages = ", ".join(f"{name} {stage['seconds']:.2f}" for name, stage in sorted(case[part]["stages"].items(), key=lambda item: -item[1]["seconds"]))
+            print(f"  {part}: {case[part]['seconds']:.2f} total; {stages}; other {case[part]['other_seconds']:.2f}")
+
+        if case["name"] in baseline_cases:
+            old = baseline_cases[case["name"]]
+            for part in ("detection", "recognition"):
+                speedup = old[part]["seconds"] / case[part]["seconds"] if case[part]["seconds"] > 0 else 0.0
+                old_accuracy, accuracy = old["accuracy"][part], case["accuracy"][part]
+                print(f"  {part} vs {baseline['commit'][:8] if baseline.get('commit') else 'baseline'}: {speedup:.2f}x, "
+                      f"precision {accuracy['precision'] - old_accuracy['precision']:+.3f}, recall {accuracy['recall'] - old_accuracy['recall']:+.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark face detection and recognition on the sample videos against the sample outputs.")
+    parser.add_argument("--sample_output_dir", type=str, default=os.path.join(REPO_ROOT, "sample_output"), help="Directory of the reference outputs.")
+    parser.add_argument("--samples", type=str, nargs="*", default=None, help="Names of the samples to run (default: all available).")
+    parser.add_argument("--output_dir", type=str, default=os.path.join(REPO_ROOT, "benchmark_results"), help="Directory for the results file and the outputs of the runs.")
+    parser.add_argument("--algorithm", type=str, default="retinaface", choices=["haar", "retinaface"], help="Face detection algorithm to use ('haar' or 'retinaface').")
+    parser.add_argument("--cascade_path", type=str, default="haarcascade_frontalface_default.xml", help="Path to the Haar Cascade XML file.")
+    parser.add_argument("--batch_size", type=int, default=1, help="Number of frames passed through the detector at once.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of parallel detection processes (no per-stage detection times if > 1).")
+    parser.add_argument("--detect_interval", type=int, default=1, help="Run the detector every N frames and track faces with optical flow in between.")
+    parser.add_argument("--detection_scale", type=float, default=1.0, help="Resize factor applied to frames before detection, e.g. 0.5.")
+    parser.add_argument("--refine", action="store_true", help="Refine downscaled detections with a full-resolution crop around each face.")
+    parser.add_argument("--roi", action="store_true", help="Detect only in windows around the previous frame's faces, with periodic full-frame scans.")
+    parser.add_argument("--full_scan_interval", type=int, default=30, help="Number of frames between two full-frame scans with --roi. Default is 30.")
+    parser.add_argument("--match_threshold", type=float, default=0.7, help="Threshold for face matching. Default is 0.7.")
+    parser.add_argument("--recognition_batch_size", type=int, default=64, help="Number of faces encoded per batch. Default is 64.")
+    parser.add_argument("--track", action="store_true", help="Link faces into tracks and only recognize a few sampled frames per track.")
+    parser.add_argument("--sample_interval", type=int, default=30, help="Frames between recognized samples of a track. Default is 30.")
+    parser.add_argument("--max_samples", type=int, default=3, help="Maximum number of recognized samples per track. Default is 3.")
+    parser.add_argument("--embedding_cache_dir", type=str, default=None, help="Face encoding cache to read and fill, e.g. to benchmark a second run over the same faces.")
+    parser.add_argument("--recognize_on", type=str, default="reference", choices=["reference", "detected"], help="Run recognition on the reference face coordinates or on the benchmarked detections.")
+    parser.add_argument("--baseline", type=str, default=None, help="Results file of an earlier commit to compare against.")
+
+    args = parser.parse_args()
+    if args.max_samples < 1:
+        parser.error("--max_samples must be at least 1")
+
+    samples = list_samples(args.sample_output_dir)
+    if args.samples:
+        samples = [sample for sample in samples if sample["name"] in args.samples]
+    if not samples:
+        print("Error: No sample with an existing video and reference image found.")
+        return
+
+    # Every option that can change the speed or the results is recorded with them
+    detection_options = {"algorithm": args.algorithm, "cascade_path": args.cascade_path, "batch_size": args.batch_size,
+                         "workers": args.workers, "detect_interval": args.detect_interval, "detection_scale": args.detection_scale,
+                         "refine": args.refine, "roi": args.roi, "full_scan_interval": args.full_scan_interval}
+    recognition_options = {"match_threshold": args.match_threshold, "batch_size": args.recognition_batch_size, "track": args.track,
+                           "sample_interval": args.sample_interval, "max_samples": args.max_samples,
+                           "embedding_cache_dir": args.embedding_cache_dir}
+
+    commit, dirty = git_commit()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+        "options": {"detection": detection_options, "recognition": recognition_options, "recognize_on": args.recognize_on},
+        "cases": [],
+    }
+
+    run_name = (commit[:8] if commit else time.strftime("%Y%m%d_%H%M%S")) + ("-dirty" if dirty else "")
+    for sample in samples:
+        print(f"Benchmarking {sample['name']} ({os.path.relpath(sample['video_path'], REPO_ROOT)})")
+        # A fresh process per case measures its own model loading and peak memory
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            case = executor.submit(run_case, sample, os.path.join(args.output_dir, run_name, sample["name"]), detection_options,
+                                   recognition_options, args.recognize_on).result()
+        results["cases"].append(case)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    results_path = os.path.join(args.output_dir, f"{run_name}.json")
+    with open(results_path, "w") as file:
+        json.dump(results, file, indent=4)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+    print_report(results, baseline)
+    print(f"\nResults saved to: {results_path}")
+
+
+if __name__ == "__main__":
+    main()
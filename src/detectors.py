@@ -0,0 +1,184 @@
+import os
+import multiprocessing
+import cv2
+import numpy as np
+from retinaface import RetinaFace
+from retinaface.commons import preprocess, postprocess
+
+# Anchors of the RetinaFace feature pyramid levels, as in RetinaFace.detect_faces
+FEATURE_STRIDES = [32, 16, 8]
+ANCHORS = {
+    32: np.array([[-248.0, -248.0, 263.0, 263.0], [-120.0, -120.0, 135.0, 135.0]], dtype=np.float32),
+    16: np.array([[-56.0, -56.0, 71.0, 71.0], [-24.0, -24.0, 39.0, 39.0]], dtype=np.float32),
+    8: np.array([[-8.0, -8.0, 23.0, 23.0], [0.0, 0.0, 15.0, 15.0]], dtype=np.float32),
+}
+NMS_THRESHOLD = 0.4
+
+
+class HaarDetector:
+    """
+    Haar Cascade face detector.
+
+    Args:
+        cascade_path (str): Name of the Haar Cascade XML file in cv2.data.haarcascades.
+    """
+
+    name = "haar"
+    color = (255, 0, 0)  # Box color for visualization
+
+    def __init__(self, cascade_path="haarcascade_frontalface_default.xml"):
+        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + cascade_path)
+
+    def detect(self, frames, allow_upscaling=True):
+        """
+        Detect faces in a list of BGR frames.
+
+        Returns:
+            list: For each frame, the detected faces as {"x", "y", "width", "height"} dicts.
+        """
+        return [self.detect_frame(frame) for frame in frames]
+
+    def detect_frame(self, frame, allow_upscaling=True):
+        # Convert to grayscale for Haar Cascade face detection
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        # Detect faces using Haar Cascade
+        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+        return [{"x": int(x), "y": int(y), "width": int(w), "height": int(h)} for (x, y, w, h) in faces]
+
+
+def decode_detections(net_out, im_info, im_scale, threshold):
+    """
+    Turn the RetinaFace network outputs of one image into face boxes.
+
+    This is the box and score part of the post-processing in RetinaFace.detect_faces, applied to the
+    image size and scale already returned by preprocess.preprocess_image, so a frame is not preprocessed twice.
+
+    Args:
+        net_out (list): The network outputs of the image, with a batch dimension of 1.
+        im_info (tuple): Size of the preprocessed image.
+        im_scale (float): Resize factor from the frame to the preprocessed image.
+        threshold (float): Minimum detection score.
+
+    Returns:
+        list: The detected faces as {"x", "y", "width", "height", "score"} dicts, best score first.
+    """
+    proposals_list, scores_list = [], []
+    for level, stride in enumerate(FEATURE_STRIDES):
+        num_anchors = len(ANCHORS[stride])
+        scores = net_out[3 * level][:, :, :, num_anchors:].reshape((-1, 1))
+        bbox_deltas = net_out[3 * level + 1]
+        height, width = bbox_deltas.shape[1], bbox_deltas.shape[2]
+
+        anchors = postprocess.anchors_plane(height, width, stride, ANCHORS[stride]).reshape((height * width * num_anchors, 4))
+        proposals = postprocess.bbox_pred(anchors, bbox_deltas.reshape((-1, bbox_deltas.shape[3] // num_anchors)))
+        proposals = postprocess.clip_boxes(proposals, im_info[:2])
+
+        order = np.where(scores.ravel() >= threshold)[0]
+        proposals_list.append(proposals[order, 0:4] / im_scale)
+        scores_list.append(scores[order])
+
+    proposals = np.vstack(proposals_list)
+    if proposals.shape[0] == 0:
+        return []
+    scores = np.vstack(scores_list)
+    order = scores.ravel().argsort()[::-1]
+    pre_det = np.hstack((proposals[order], scores[order])).astype(np.float32, copy=False)
+    faces = []
+    for face in pre_det[postprocess.cpu_nms(pre_det, NMS_THRESHOLD)]:
+        x, y, x1, y1 = face[0:4].astype(int)
+        faces.append({"x": int(x), "y": int(y), "width": int(x1 - x), "height": int(y1 - y), "score": float(face[4])})
+    return faces
+
+
+class RetinaFaceDetector:
+    """
+    RetinaFace face detector that builds the model once and runs frames through it in batches.
+
+    Args:
+        threshold (float): Minimum detection score.
+        warmup_size (tuple): (height, width) of the dummy frame used to warm up the model, or None.
+    """
+
+    name = "retinaface"
+    color = (0, 255, 0)  # Box color for visualization
+
+    def __init__(self, threshold=0.9, warmup_size=(720, 1280)):
+        self.threshold = threshold
+        self.model = RetinaFace.build_model()
+        if warmup_size is not None:
+            self.detect_frame(np.zeros((*warmup_size, 3), dtype=np.uint8))
+
+    def detect(self, frames, allow_upscaling=True):
+        """
+        Detect faces in a list of BGR frames.
+
+        Frames that share an input size after preprocessing go through the network in one forward pass.
+
+        Returns:
+            list: For each frame, the detected faces as {"x", "y", "width", "height", "score"} dicts.
+        """
+        # The image size and scale of the preprocessing are kept for decoding the boxes
+        preprocessed = [preprocess.preprocess_image(frame, allow_upscaling) for frame in frames]
+        tensors = [im_tensor for im_tensor, _, _ in preprocessed]
+        results = [None] * len(frames)
+
+        batches = {}
+        for i, im_tensor in enumerate(tensors):
+            batches.setdefault(im_tensor.shape, []).append(i)
+
+        for indices in batches.values():
+            net_out = [output.numpy() for output in self.model(np.concatenate([tensors[i] for i in indices]))]
+            for b, i in enumerate(indices):
+                _, im_info, im_scale = preprocessed[i]
+                results[i] = decode_detections([output[b:b + 1] for output in net_out], im_info, im_scale, self.threshold)
+
+        return results
+
+    def detect_frame(self, frame, allow_upscaling=True):
+        detections = RetinaFace.detect_faces(frame, threshold=self.threshold, model=self.model, allow_upscaling=allow_upscaling)
+        return self._to_faces(detections)
+
+    @staticmethod
+    def _to_faces(detections):
+        frame_faces = []
+        for key in detections:
+            x, y, x1, y1 = detections[key]['facial_area']
+            frame_faces.append({"x": int(x), "y": int(y), "width": int(x1 - x), "height": int(y1 - y),
+                                "score": float(detections[key]['score'])})
+        return frame_faces
+
+
+def create_detector(algorithm="haar", cascade_path="haarcascade_frontalface_default.xml", num_threads=None):
+    """
+    Build the face detector for `algorithm` ("haar" or "retinaface"), or return None if unsupported.
+
+    With `num_threads`, OpenCV and TensorFlow in this process are limited to that many threads, for a
+    worker process that shares the cores with others (see worker_threads).
+    """
+    if num_threads is not None:
+        cv2.setNumThreads(num_threads)
+        if algorithm == "retinaface":
+            import tensorflow as tf
+            tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+    if algorithm == "haar":
+        return HaarDetector(cascade_path)
+    if algorithm == "retinaface":
+        return RetinaFaceDetector()
+    return None
+
+
+def worker_threads(workers):
+    """
+    Return the number of threads of each of `workers` detector processes, so that together they use every core once.
+    """
+    return max(1, (os.cpu_count() or 1) // max(workers, 1))
+
+
+def worker_context():
+    """
+    Return the multiprocessing context for detector worker processes.
+    """
+    # TensorFlow does not survive fork(), so workers are started fresh
+    return multiprocessing.get_context("spawn")
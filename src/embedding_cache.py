@@ -0,0 +1,109 @@
+import os
+import json
+import hashlib
+import numpy as np
+from face_encoder import ENCODER_MODEL
+from face_store import FaceCoordinatesReader
+
+# Size of each chunk of the video file that is hashed
+VIDEO_HASH_CHUNK_SIZE = 1 << 20
+
+
+def video_fingerprint(video_path, chunk_size=VIDEO_HASH_CHUNK_SIZE):
+    """
+    Hash the size and the first, middle and last `chunk_size` bytes of a video file.
+
+    This identifies the video content without reading the whole file.
+    """
+    size = os.path.getsize(video_path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(video_path, "rb") as file:
+        for offset in sorted({0, max(0, size // 2 - chunk_size // 2), max(0, size - chunk_size)}):
+            file.seek(offset)
+            digest.update(file.read(chunk_size))
+    return digest.hexdigest()
+
+
+def face_boxes(face_coordinates):
+    """
+    Return the faces of frame-wise face data as an (N, 5) array of (frame, x, y, width, height) rows.
+
+    Rows are in the order faces are iterated: by frame, then in detection order.
+    """
+    if isinstance(face_coordinates, FaceCoordinatesReader):
+        columns = face_coordinates.columns
+        return np.stack([np.asarray(columns[name], dtype=np.int64) for name in ("frame", "x", "y", "width", "height")], axis=1)
+
+    rows = [(entry["frame"], face["x"], face["y"], face["width"], face["height"])
+            for entry in face_coordinates for face in entry["faces"]]
+    return np.array(rows, dtype=np.int64).reshape(-1, 5)
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of the face encodings of a video, memory-mapped as an (N_faces, 128) array.
+
+    Row i holds the encoding of the i-th face of the face coordinates, and `computed[i]` tells
+    whether it has been encoded yet. The cache directory is keyed by a hash of the video content,
+    of the face boxes and of the encoder model, so any change to them starts a new cache.
+
+    Args:
+        cache_root (str): Directory that holds the caches of all videos.
+        video_path (str): Path to the video file.
+        face_coordinates: Frame-wise face data (list or FaceCoordinatesReader).
+        model (str): Identifier of the face encoder.
+    """
+
+    def __init__(self, cache_root, video_path, face_coordinates, model=ENCODER_MODEL):
+        boxes = face_boxes(face_coordinates)
+        digest = hashlib.sha1()
+        digest.update(video_fingerprint(video_path).encode())
+        digest.update(boxes.tobytes())
+        digest.update(model.encode())
+        self.path = os.path.join(cache_root, digest.hexdigest()[:16])
+        self.num_faces = len(boxes)
+
+        embeddings_path = os.path.join(self.path, "embeddings.npy")
+        computed_path = os.path.join(self.path, "computed.npy")
+        self.meta_path = os.path.join(self.path, "meta.json")
+        if os.path.exists(self.meta_path):
+            self.embeddings = np.load(embeddings_path, mmap_mode="r+")
+            self.computed = np.load(computed_path, mmap_mode="r+")
+            with open(self.meta_path, "r") as file:
+                self.meta = json.load(file)
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            self.embeddings = np.lib.format.open_memmap(embeddings_path, mode="w+", dtype=np.float64, shape=(self.num_faces, 128))
+            self.computed = np.lib.format.open_memmap(computed_path, mode="w+", dtype=bool, shape=(self.num_faces,))
+            # meta.json is written last and marks the cache as usable
+            self.meta = {"video_path": os.path.abspath(video_path), "num_faces": self.num_faces, "model": model}
+            self._save_meta()
+
+    @property
+    def num_computed(self):
+        return int(np.count_nonzero(self.computed))
+
+    @property
+    def scene_cuts(self):
+        """
+        Scene cuts between the frames with faces, saved by an earlier run, or None.
+        """
+        return self.meta.get("scene_cuts")
+
+    @scene_cuts.setter
+    def scene_cuts(self, scene_cuts):
+        self.meta["scene_cuts"] = sorted(int(frame_index) for frame_index in scene_cuts)
+        self._save_meta()
+
+    def put(self, rows, encodings):
+        self.embeddings[rows] = encodings
+        self.computed[rows] = True
+
+    def flush(self):
+        self.embeddings.flush()
+        self.computed.flush()
+
+    def _save_meta(self):
+        with open(self.meta_path + ".tmp", "w") as file:
+            json.dump(self.meta, file, indent=4)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
@@ -0,0 +1,140 @@
+import cv2
+import json
+import time
+import argparse
+from tqdm import tqdm
+from detectors import create_detector
+from face_detection import IntervalDetector
+from face_store import load_face_coordinates
+from scene_detection import SceneCutDetector
+from tracking import box_iou
+
+
+def compare_face_coordinates(predicted, reference, iou_threshold=0.5, min_face_size=0):
+    """
+    Compare frame-wise face data against a reference run.
+
+    Faces are matched greedily per frame by IoU.
+
+    Args:
+        predicted (list): Frame-wise face data, as saved to face_coordinates.json.
+        reference (list): Reference frame-wise face data.
+        iou_threshold (float): Minimum IoU for a predicted face to count as correct.
+        min_face_size (int): Faces narrower than this many pixels are ignored on both sides.
+
+    Returns:
+        dict: Precision, recall and mean IoU of the matched faces.
+    """
+    predicted_faces = {entry["frame"]: entry["faces"] for entry in predicted}
+    true_positives, num_predicted, num_reference, iou_sum = 0, 0, 0, 0.0
+
+    for entry in reference:
+        boxes = [(f["x"], f["y"], f["width"], f["height"]) for f in predicted_faces.get(entry["frame"], [])
+                 if f["width"] >= min_face_size]
+        reference_boxes = [(f["x"], f["y"], f["width"], f["height"]) for f in entry["faces"]
+                           if f["width"] >= min_face_size]
+        num_predicted += len(boxes)
+        num_reference += len(reference_boxes)
+
+        pairs = sorted(((box_iou(p, r), i, j) for i, p in enumerate(boxes) for j, r in enumerate(reference_boxes)), reverse=True)
+        used_predicted, used_reference = set(), set()
+        for iou, i, j in pairs:
+            if iou < iou_threshold:
+                break
+            if i in used_predicted or j in used_reference:
+                continue
+            used_predicted.add(i)
+            used_reference.add(j)
+            true_positives += 1
+            iou_sum += iou
+
+    return {
+        "precision": true_positives / num_predicted if num_predicted else 1.0,
+        "recall": true_positives / num_reference if num_reference else 1.0,
+        "mean_iou": iou_sum / true_positives if true_positives else 0.0,
+    }
+
+
+def run_detection(video_path, detector):
+    """
+    Run a detector over every frame of a video and return (face_data, seconds).
+
+    Scene cuts are detected as in face_detection.py and passed to the detector, and are part of the timing.
+    """
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    scene_detector = SceneCutDetector()
+    face_data = []
+    frame_count = 0
+
+    start = time.perf_counter()
+    with tqdm(total=total_frames, desc=video_path, unit="frame", leave=False) as pbar:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            scene_cut = scene_detector.update(frame_count, frame)
+            face_data.append({"frame": frame_count, "faces": detector.detect(frame, scene_cut)})
+            frame_count += 1
+            pbar.update(1)
+    elapsed = time.perf_counter() - start
+
+    cap.release()
+    return face_data, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the accuracy and speedup of --detect_interval, --detection_scale and --roi against detecting every full frame.")
+    parser.add_argument("--video_paths", type=str, nargs="+", required=True, help="Paths to the input video files.")
+    parser.add_argument("--algorithm", type=str, default="haar", choices=["haar", "retinaface"], help="Face detection algorithm to use ('haar' or 'retinaface').")
+    parser.add_argument("--cascade_path", type=str, default="haarcascade_frontalface_default.xml", help="Path to the Haar Cascade XML file.")
+    parser.add_argument("--intervals", type=int, nargs="*", default=[2, 4, 8], help="Detection intervals to evaluate.")
+    parser.add_argument("--scales", type=float, nargs="*", default=[], help="Detection scales to evaluate.")
+    parser.add_argument("--refine", action="store_true", help="Refine downscaled detections at full resolution.")
+    parser.add_argument("--full_scan_intervals", type=int, nargs="*", default=[], help="Full-frame scan intervals of ROI detection to evaluate.")
+    parser.add_argument("--reference_paths", type=str, nargs="*", default=[], help="Saved face_coordinates store or JSON file per video to compare against, instead of the full-frame run.")
+    parser.add_argument("--min_face_size", type=int, default=0, help="Ignore faces narrower than this many pixels when comparing.")
+    parser.add_argument("--output", type=str, default=None, help="Optional path to save the report as JSON.")
+
+    args = parser.parse_args()
+
+    face_detector = create_detector(args.algorithm, args.cascade_path)
+
+    report = []
+    for v, video_path in enumerate(args.video_paths):
+        # Detecting every full frame is the reference for speed, and for accuracy unless a saved output is given
+        reference, reference_time = run_detection(video_path, IntervalDetector(face_detector, 1))
+        if v < len(args.reference_paths):
+            reference = load_face_coordinates(args.reference_paths[v])
+        configurations = ([(interval, 1.0, None) for interval in args.intervals] + [(1, scale, None) for scale in args.scales]
+                          + [(1, 1.0, full_scan_interval) for full_scan_interval in args.full_scan_intervals])
+        for interval, scale, full_scan_interval in configurations:
+            detector = IntervalDetector(face_detector, interval, scale=scale, refine=args.refine, roi=full_scan_interval is not None,
+                                        full_scan_interval=full_scan_interval or 30)
+            face_data, elapsed = run_detection(video_path, detector)
+            report.append({
+                "video": video_path,
+                "detect_interval": interval,
+                "detection_scale": scale,
+                "full_scan_interval": full_scan_interval,
+                "detector_runs": detector.num_detections,
+                "full_scans": detector.num_full_scans,
+                "pixels_scanned": detector.pixels_scanned / detector.pixels_total if detector.pixels_total else 0.0,
+                "frames": len(face_data),
+                "speedup": reference_time / elapsed,
+                **compare_face_coordinates(face_data, reference, min_face_size=args.min_face_size),
+            })
+
+    print("| video | interval | scale | ROI full scan | detector runs | full scans | pixels | speedup | precision | recall | mean IoU |")
+    print("|---|---|---|---|---|---|---|---|---|---|---|")
+    for row in report:
+        print(f"| {row['video']} | {row['detect_interval']} | {row['detection_scale']} | {row['full_scan_interval'] or '-'} | "
+              f"{row['detector_runs']}/{row['frames']} | {row['full_scans']} | {100 * row['pixels_scanned']:.0f}% | {row['speedup']:.2f}x | {row['precision']:.3f} | {row['recall']:.3f} | {row['mean_iou']:.3f} |")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,490 @@
 import cv2
 import os
+import re
 import json
 import argparse
+import subprocess
+import imageio_ffmpeg
 from tqdm import tqdm
-from retinaface import RetinaFace
+from detectors import create_detector, worker_context, worker_threads
+from face_store import FaceDataWriter
+from profiling import StageTimer
+from scene_detection import SCENE_CUTS_FILE, SceneCutDetector, save_scene_cuts
+from tracking import OpticalFlowBoxTracker, box_iou
 
-def detect_faces_in_video(video_path, output_folder="output", cascade_path="haarcascade_frontalface_default.xml", algorithm="haar", debug=False):
+CHECKPOINT_FILE = "checkpoint.json"
+
+def matching_box(box, candidates, min_iou=0.5):
+    """
+    Return the candidate (x, y, w, h) box with the highest IoU with `box`, or None if it is below `min_iou`.
+    """
+    best = max(candidates, key=lambda candidate: box_iou(candidate, box), default=None)
+    if best is None or box_iou(best, box) < min_iou:
+        return None
+    return best
+
+
+def pad_box(box, frame_shape, padding=0.25):
+    """
+    Pad an (x, y, w, h) box by `padding` times its size on every side and clip it to the frame.
+
+    Returns:
+        tuple: The (x0, y0, x1, y1) window, or None if nothing of it is inside the frame.
+    """
+    x, y, w, h = box
+    frame_height, frame_width = frame_shape[:2]
+    x0, y0 = max(0, x - int(w * padding)), max(0, y - int(h * padding))
+    x1, y1 = min(frame_width, x + w + int(w * padding)), min(frame_height, y + h + int(h * padding))
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1, y1
+
+
+def refine_box(frame, box, detector, padding=0.25, min_iou=0.3):
+    """
+    Re-detect a face at full resolution in a padded crop around its (x, y, w, h) box.
+
+    Returns:
+        tuple: The refined box, or the input box if the crop has no overlapping detection.
+    """
+    window = pad_box(box, frame.shape, padding)
+    if window is None:
+        return box
+
+    x0, y0, x1, y1 = window
+    candidates = [(face["x"] + x0, face["y"] + y0, face["width"], face["height"])
+                  for face in detector.detect_frame(frame[y0:y1, x0:x1], allow_upscaling=False)]
+    return matching_box(box, candidates, min_iou) or box
+
+
+def detect_faces(frames, detector, scale=1.0, refine=False, allow_upscaling=True):
+    """
+    Detect faces in a batch of frames, optionally on downscaled copies with the boxes mapped back to frame coordinates.
+
+    Args:
+        frames (list): The BGR frames to process.
+        detector: Face detector from detectors.create_detector.
+        scale (float): Resize factor applied before detection. 1.0 detects on the full frames.
+        refine (bool): If True, refine each downscaled box with a full-resolution detection around it.
+        allow_upscaling (bool): Let RetinaFace upscale small full-scale frames, e.g. False for crops.
+
+    Returns:
+        list: For each frame, the detected faces as {"x", "y", "width", "height"} dicts in frame coordinates.
+    """
+    if scale >= 1.0:
+        return detector.detect(frames, allow_upscaling=allow_upscaling)
+
+    # RetinaFace would otherwise upscale the small frames back to its 1024 pixel input size
+    small_frames = [cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) for frame in frames]
+    results = []
+    for frame, small_faces in zip(frames, detector.detect(small_frames, allow_upscaling=False)):
+        frame_faces = []
+        for face in small_faces:
+            box = tuple(int(round(face[key] / scale)) for key in ("x", "y", "width", "height"))
+            if refine:
+                box = refine_box(frame, box, detector)
+            x, y, w, h = box
+            scaled_face = {"x": int(x), "y": int(y), "width": int(w), "height": int(h)}
+            if "score" in face:
+                scaled_face["score"] = face["score"]
+            frame_faces.append(scaled_face)
+        results.append(frame_faces)
+
+    return results
+
+
+def roi_windows(boxes, frame_shape, padding=0.25):
+    """
+    Build the detection windows around the (x, y, w, h) boxes of the previous frame.
+
+    Each box is padded and clipped to the frame (see pad_box), and overlapping windows are
+    replaced by their bounding rectangle until no two overlap.
+
+    Returns:
+        list: (x0, y0, x1, y1) windows in frame coordinates.
+    """
+    windows = [window for window in (pad_box(box, frame_shape, padding) for box in boxes) if window is not None]
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(windows)):
+            for j in range(i + 1, len(windows)):
+                a, b = windows[i], windows[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    windows[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del windows[j]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    return windows
+
+
+def draw_faces(frame, frame_faces, color=(255, 0, 0)):
+    """
+    Draw bounding boxes of detected faces onto a frame in place.
+    """
+    for face in frame_faces:
+        x, y, w, h = face["x"], face["y"], face["width"], face["height"]
+        cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+
+
+class IntervalDetector:
+    """
+    Run face detection on every `detect_interval`-th frame and track the boxes with optical flow in between.
+
+    The detector runs again right away when the tracker loses confidence or at a scene cut.
+
+    With `roi`, a detector run only scans padded windows around the boxes of the previous frame
+    (see roi_windows). The whole frame is scanned at the first run after every `full_scan_interval`
+    frames, at scene cuts, when no face is known, when the windows would cover most of the frame,
+    and again right away when the windows miss a face, so that new faces are still found. A box that
+    this rescan finds where its window missed it flickers rather than moves. It is suppressed until
+    the next periodic full scan: it keeps its window, but missing it no longer causes a rescan.
+
+    Args:
+        detector: Face detector from detectors.create_detector.
+        detect_interval (int): Number of frames between two detector runs.
+        min_confidence (float): Lowest tracker confidence accepted before re-detecting.
+        scale (float): Resize factor applied to frames before detection (see detect_faces).
+        refine (bool): If True, refine downscaled detections at full resolution.
+        roi (bool): If True, detect in windows around the previous boxes between full-frame scans.
+        full_scan_interval (int): Number of frames between two full-frame scans with `roi`.
+        roi_padding (float): Padding of the windows, as a fraction of the face size on each side.
+        max_roi_coverage (float): Scan the full frame instead when the windows cover more than this fraction of it.
+    """
+
+    def __init__(self, detector, detect_interval=1, min_confidence=0.5, scale=1.0, refine=False, roi=False,
+                 full_scan_interval=30, roi_padding=0.25, max_roi_coverage=0.5):
+        self.detector = detector
+        self.scale = scale
+        self.refine = refine
+        self.detect_interval = detect_interval
+        self.min_confidence = min_confidence
+        self.tracker = OpticalFlowBoxTracker()
+        self.frames_since_detection = None
+        self.num_detections = 0
+        self.roi = roi
+        self.full_scan_interval = full_scan_interval
+        self.roi_padding = roi_padding
+        self.max_roi_coverage = max_roi_coverage
+        self.previous_boxes = []  # Boxes of the last frame
+        self.suppressed_boxes = []  # Flickering boxes whose misses cause no rescan until the next periodic full scan
+        self.frames_since_full_scan = None
+        self.num_full_scans = 0
+        self.pixels_scanned = 0  # Pixels passed to the detector
+        self.pixels_total = 0  # Pixels of all frames
+
+    @property
+    def full_scan_due(self):
+        """
+        True if the next detector run scans the whole frame: no face is known, not even a suppressed one, or a periodic scan is due.
+        """
+        return ((not self.previous_boxes and not self.suppressed_boxes) or self.frames_since_full_scan is None
+                or self.frames_since_full_scan + 1 >= self.full_scan_interval)
+
+    @property
+    def detects_next_frame(self):
+        """
+        True if the next frame runs the detector regardless of the tracker state, so a run can restart there.
+        """
+        return ((self.detect_interval <= 1 or self.frames_since_detection is None
+                 or self.frames_since_detection + 1 >= self.detect_interval)
+                and (not self.roi or self.full_scan_due))
+
+    def detect_batch(self, frames, scene_cuts=None):
+        """
+        Return the faces of the next frames. Without tracking or ROI, all frames go through the detector as one batch.
+
+        `scene_cuts` tells for each frame whether a new scene starts at it (see scene_detection.SceneCutDetector).
+        """
+        if self.detect_interval <= 1 and not self.roi:
+            self.num_detections += len(frames)
+            self.num_full_scans += len(frames)
+            for frame in frames:
+                self.pixels_total += frame.shape[0] * frame.shape[1]
+                self.pixels_scanned += int(frame.shape[0] * frame.shape[1] * min(self.scale, 1.0) ** 2)
+            return detect_faces(frames, self.detector, self.scale, self.refine)
+        if scene_cuts is None:
+            scene_cuts = [False] * len(frames)
+        return [self.detect(frame, scene_cut) for frame, scene_cut in zip(frames, scene_cuts)]
+
+    def detect(self, frame, scene_cut=False):
+        """
+        Return the faces of the next frame as {"x", "y", "width", "height"} dicts.
+        """
+        if self.detect_interval <= 1 and not self.roi:
+            return self.detect_batch([frame])[0]
+
+        self.pixels_total += frame.shape[0] * frame.shape[1]
+        full_scan = not self.roi or scene_cut or self.full_scan_due
+        if self.frames_since_full_scan is not None:
+            self.frames_since_full_scan += 1
+
+        if (self.detect_interval > 1 and self.frames_since_detection is not None and not scene_cut
+                and self.frames_since_detection + 1 < self.detect_interval):
+            boxes, confidence = self.tracker.update(frame)
+            if confidence >= self.min_confidence:
+                self.frames_since_detection += 1
+                self.previous_boxes = boxes
+                return [{"x": x, "y": y, "width": w, "height": h} for x, y, w, h in boxes]
+
+        missed = []
+        if not full_scan:
+            windows_result = self._detect_windows(frame)
+            if windows_result is None:
+                full_scan = True
+            else:
+                frame_faces, missed = windows_result
+        if full_scan:
+            # Suppressed boxes get another chance at every full scan that was not caused by a miss
+            self.suppressed_boxes = []
+        # A face that left its window is searched for in the whole frame right away
+        if full_scan or missed:
+            frame_faces = self._detect_full_frame(frame)
+
+        boxes = [(f["x"], f["y"], f["width"], f["height"]) for f in frame_faces]
+        if self.detect_interval > 1:
+            self.tracker.start(frame, boxes)
+        # A box found again where the windows missed it flickers in and out of the detections rather than moving;
+        # it is suppressed instead of forcing a full scan every frame, and follows its detections while they last
+        self.suppressed_boxes = [matching_box(suppressed, boxes) or suppressed for suppressed in self.suppressed_boxes]
+        self.suppressed_boxes += [box for box in boxes if matching_box(box, missed)]
+        self.previous_boxes = boxes
+        self.frames_since_detection = 0
+        self.num_detections += 1
+        return frame_faces
+
+    def _detect_full_frame(self, frame):
+        self.pixels_scanned += int(frame.shape[0] * frame.shape[1] * min(self.scale, 1.0) ** 2)
+        self.frames_since_full_scan = 0
+        self.num_full_scans += 1
+        return detect_faces([frame], self.detector, self.scale, self.refine)[0]
+
+    def _detect_windows(self, frame):
+        """
+        Detect in the windows around the previous boxes.
+
+        Returns:
+            tuple: (faces, previous boxes without a detection in the windows), or None if the windows cover too much of the frame.
+        """
+        windows = roi_windows(self.previous_boxes + self.suppressed_boxes, frame.shape, self.roi_padding)
+        area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in windows)
+        if not windows or area > self.max_roi_coverage * frame.shape[0] * frame.shape[1]:
+            return None
+
+        crops = [frame[y0:y1, x0:x1] for x0, y0, x1, y1 in windows]
+        self.pixels_scanned += int(area * min(self.scale, 1.0) ** 2)
+        # The crops are scanned at their own resolution rather than upscaled to the RetinaFace input size
+        crop_faces = detect_faces(crops, self.detector, self.scale, self.refine, allow_upscaling=False)
+        frame_faces = []
+        for (x0, y0, _, _), faces in zip(windows, crop_faces):
+            for face in faces:
+                frame_faces.append({**face, "x": face["x"] + x0, "y": face["y"] + y0})
+
+        boxes = [(f["x"], f["y"], f["width"], f["height"]) for f in frame_faces]
+        # Suppressed boxes are expected to come and go
+        missed = [previous for previous in self.previous_boxes
+                  if not matching_box(previous, boxes, min_iou=0.3) and not matching_box(previous, self.suppressed_boxes)]
+        return frame_faces, missed
+
+
+def find_keyframes(video_path, fps):
+    """
+    List the keyframes of a video with ffmpeg, without decoding the other frames.
+
+    Args:
+        video_path (str): Path to the input video file.
+        fps (float): Frame rate used to convert keyframe timestamps into frame indices.
+
+    Returns:
+        list: Sorted frame indices of the keyframes. Only [0] if they cannot be determined.
+    """
+    command = [imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-nostats", "-skip_frame", "nokey",
+               "-i", video_path, "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-"]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True)
+    except OSError:
+        return [0]
+
+    pts_times = [float(t) for t in re.findall(r"pts_time:\s*(-?[0-9.]+)", result.stderr)]
+    if result.returncode != 0 or not pts_times:
+        return [0]
+
+    # Timestamps are relative to the first frame, which is always a keyframe
+    return sorted({0} | {int(round((t - pts_times[0]) * fps)) for t in pts_times})
+
+
+def plan_shards(keyframes, total_frames, num_shards, start_frame=0):
+    """
+    Split the frame range [start_frame, total_frames) into contiguous shards of roughly equal length.
+
+    Shard boundaries are moved to the nearest keyframe when one lies within a quarter shard length,
+    so that seeking to the start of a shard does not decode frames of the previous shard.
+
+    Returns:
+        list: (start, end) frame ranges in order. The last range ends at None (end of video).
+    """
+    shard_length = (total_frames - start_frame) / max(num_shards, 1)
+    boundaries = [start_frame]
+    for i in range(1, num_shards):
+        target = start_frame + int(round(i * shard_length))
+        nearest = min(keyframes, key=lambda keyframe: abs(keyframe - target))
+        boundary = nearest if abs(nearest - target) <= shard_length / 4 else target
+        if boundaries[-1] < boundary < total_frames:
+            boundaries.append(boundary)
+
+    return list(zip(boundaries, boundaries[1:] + [None]))
+
+
+def load_checkpoint(output_folder):
+    """
+    Load the detection checkpoint saved in `output_folder`, or return None if there is none.
+    """
+    checkpoint_path = os.path.join(output_folder, CHECKPOINT_FILE)
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, "r") as file:
+        return json.load(file)
+
+
+def save_checkpoint(output_folder, checkpoint):
+    """
+    Atomically replace the detection checkpoint in `output_folder`.
+    """
+    checkpoint_path = os.path.join(output_folder, CHECKPOINT_FILE)
+    with open(checkpoint_path + ".tmp", "w") as file:
+        json.dump(checkpoint, file, indent=4)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+
+def seed_scene_detector(cap, scene_detector, start_frame):
+    """
+    Decode the frame before `start_frame` into the scene cut detector, leaving `cap` at `start_frame`.
+    """
+    if start_frame > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame - 1)
+        ret, frame = cap.read()
+        if ret:
+            scene_detector.update(start_frame - 1, frame)
+
+
+_shard_worker = {}
+
+
+def _init_shard_worker(algorithm, cascade_path, num_threads, detector_options):
+    # Load the detector once per process and keep each process on its share of the cores
+    _shard_worker["detector"] = create_detector(algorithm, cascade_path, num_threads)
+    _shard_worker["detector_options"] = detector_options
+
+
+def _detect_shard(task):
+    video_path, start, end = task
+    cap = cv2.VideoCapture(video_path)
+    if start > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+    detector = IntervalDetector(_shard_worker["detector"], **_shard_worker["detector_options"])
+    scene_detector = SceneCutDetector()
+    shard_data = []
+    first_thumbnail = None
+    frame_count = start
+    while end is None or frame_count < end:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        scene_cut = scene_detector.update(frame_count, frame)
+        if first_thumbnail is None:
+            first_thumbnail = scene_detector.previous[1]
+        frame_faces = detector.detect(frame, scene_cut)
+        # The cuts are decided again in frame order by the parent, which also compares the shard boundaries
+        score = None if frame_count == start else scene_detector.last_score
+        shard_data.append({"frame": frame_count, "faces": frame_faces, "scene_score": score})
+        frame_count += 1
+
+    cap.release()
+    return shard_data, first_thumbnail, scene_detector.previous
+
+
+def detect_faces_parallel(video_path, face_writer, algorithm="haar", cascade_path="haarcascade_frontalface_default.xml", workers=2, shards_per_worker=4, detect_interval=1, scale=1.0, refine=False,
+                          start_frame=0, on_shard_done=None, scene_detector=None, roi=False, full_scan_interval=30):
+    """
+    Run face detection on keyframe-aligned time shards of a video in separate processes.
+
+    Each shard is decoded and detected independently, and the per-frame results are written
+    in frame order as the shards complete, giving the same face data as a serial run.
+
+    Args:
+        video_path (str): Path to the input video file.
+        face_writer (FaceDataWriter): Writer that receives the frame-wise face data.
+        algorithm (str): The face detection algorithm to use ("haar" or "retinaface").
+        cascade_path (str): Path to the Haar Cascade XML file for face detection (used with Haar algorithm).
+        workers (int): Number of worker processes.
+        shards_per_worker (int): Number of shards per worker, for load balancing.
+        detect_interval (int): Number of frames between two detector runs (see IntervalDetector).
+        scale (float): Resize factor applied to frames before detection.
+        refine (bool): If True, refine downscaled detections at full resolution.
+        start_frame (int): First frame to detect, when resuming a run.
+        on_shard_done (callable): Called with the next frame index after each shard has been written.
+        scene_detector (SceneCutDetector): Receives the scene cut scores of the shards in frame order, or None.
+        roi (bool): If True, detect in windows around the previous boxes between full-frame scans.
+        full_scan_interval (int): Number of frames between two full-frame scans with `roi`.
+
+    Returns:
+        int: Index of the frame after the last detected frame.
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    keyframes = find_keyframes(video_path, fps)
+    shards = plan_shards(keyframes, total_frames, workers * shards_per_worker, start_frame)
+    tasks = [(video_path, start, end) for start, end in shards]
+    num_threads = worker_threads(workers)
+    detector_options = {"detect_interval": detect_interval, "scale": scale, "refine": refine, "roi": roi,
+                        "full_scan_interval": full_scan_interval}
+
+    with worker_context().Pool(workers, initializer=_init_shard_worker, initargs=(algorithm, cascade_path, num_threads, detector_options)) as pool:
+        with tqdm(total=total_frames, initial=start_frame, desc=f"Processing Video ({workers} workers)", unit="frame") as pbar:
+            for shard_data, first_thumbnail, last_thumbnail in pool.imap(_detect_shard, tasks):
+                if scene_detector is not None and shard_data:
+                    # A shard cannot see the frame before it, so its first frame is compared here
+                    previous = scene_detector.previous
+                    if previous is not None and previous[0] == shard_data[0]["frame"] - 1:
+                        shard_data[0]["scene_score"] = scene_detector.score(previous[1], first_thumbnail)
+                    scene_detector.previous = last_thumbnail
+                for entry in shard_data:
+                    face_writer.write(entry["frame"], entry["faces"])
+                    if scene_detector is not None:
+                        scene_detector.add_score(entry["frame"], entry["scene_score"])
+                    start_frame = entry["frame"] + 1
+                pbar.update(len(shard_data))
+                if on_shard_done is not None:
+                    on_shard_done(start_frame)
+
+    return start_frame
+
+
+def detect_faces_in_video(video_path, output_folder="output", cascade_path="haarcascade_frontalface_default.xml", algorithm="haar", debug=False, workers=1, detect_interval=1,
+                          detection_scale=1.0, refine=False, batch_size=1, output_format="npy", resume=False, checkpoint_interval=1000,
+                          timer=None, roi=False, full_scan_interval=30):
     """
     Perform face detection on a video using the specified algorithm, save the processed video with bounding boxes,
-    and generate a JSON file with frame-wise face coordinates.
+    and stream the frame-wise face coordinates to disk.
+
+    With more than one worker, detection runs on time shards in parallel processes and only the face coordinates
+    are written (no processed video and no visualization).
+
+    The face coordinates are flushed to disk with a checkpoint.json every `checkpoint_interval` frames (after every
+    shard with several workers). With `resume`, the run restarts after the last checkpoint and appends to the saved
+    face coordinates; the processed video of the resumed part is saved to a separate file.
+
+    Scene cuts are detected on the decoded frames and saved to scene_cuts.json, where face_recog.py reads them.
 
     Args:
         video_path (str): Path to the input video file.
@@ -16,14 +492,20 @@ def detect_faces_in_video(video_path, output_folder="output", cascade_path="haar
         cascade_path (str): Path to the Haar Cascade XML file for face detection (used with Haar algorithm).
         algorithm (str): The face detection algorithm to use ("haar" or "retinaface").
         debug (bool): If True, visualize face detection during processing.
+        workers (int): Number of detection processes.
+        detect_interval (int): Run the detector every `detect_interval` frames and track boxes in between.
+        detection_scale (float): Resize factor applied to frames before detection.
+        refine (bool): If True, refine downscaled detections with a full-resolution crop.
+        batch_size (int): Number of frames passed through the detector at once (when detecting every frame without `roi`).
+        output_format (str): Face coordinates format: "npy" (binary face_coordinates store), "json" or "both".
+        resume (bool): If True, continue from the checkpoint in `output_folder` instead of starting over.
+        checkpoint_interval (int): Number of frames between two checkpoints.
+        timer (StageTimer): Receives the time spent in each stage (see benchmark.py); with several workers, all of it is "detect".
+        roi (bool): If True, detect only around the faces of the previous frame between full-frame scans (see IntervalDetector).
+        full_scan_interval (int): Number of frames between two full-frame scans with `roi`.
     """
-    # Initialize the chosen face detection algorithm
-    if algorithm == "haar":
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + cascade_path)
-        print("Using Haar Cascade for face detection.")
-    elif algorithm == "retinaface":
-        print("Using RetinaFace for face detection.")
-    else:
+    timer = timer if timer is not None else StageTimer()
+    if algorithm not in ("haar", "retinaface"):
         print("Error: Unsupported algorithm. Choose 'haar' or 'retinaface'.")
         return
 
@@ -33,6 +515,65 @@ def detect_faces_in_video(video_path, output_folder="output", cascade_path="haar
         print("Error: Cannot open video.")
         return
 
+    # Settings that change the face coordinates; a run can only be resumed with the same ones
+    settings = {"video_path": os.path.abspath(video_path), "algorithm": algorithm, "cascade_path": cascade_path,
+                "detect_interval": detect_interval, "detection_scale": detection_scale, "refine": refine,
+                "output_format": output_format, "roi": roi, "full_scan_interval": full_scan_interval}
+    start_frame = 0
+    writer_state = None
+    scene_cuts = []
+    if resume:
+        checkpoint = load_checkpoint(output_folder)
+        if checkpoint is None:
+            print(f"No checkpoint found in {output_folder}, starting from the first frame.")
+        elif checkpoint["settings"] != settings:
+            print(f"Error: The checkpoint in {output_folder} was saved with different settings: {checkpoint['settings']}")
+            cap.release()
+            return
+        elif checkpoint["complete"]:
+            print(f"Face detection is already complete in {output_folder}.")
+            cap.release()
+            return
+        else:
+            start_frame = checkpoint["next_frame"]
+            writer_state = checkpoint["outputs"]
+            scene_cuts = checkpoint.get("scene_cuts", [])
+            print(f"Resuming face detection from frame {start_frame}.")
+
+    os.makedirs(output_folder, exist_ok=True)
+    face_writer = FaceDataWriter(output_folder, output_format, writer_state)
+    scene_detector = SceneCutDetector(scene_cuts=scene_cuts)
+    seed_scene_detector(cap, scene_detector, start_frame)
+
+    def write_checkpoint(next_frame, complete=False):
+        outputs = None if complete else face_writer.checkpoint()
+        # The scene cut detector may already be ahead of next_frame within a batch
+        checkpoint_scene_cuts = [frame_index for frame_index in scene_detector.scene_cuts if frame_index < next_frame]
+        if complete:
+            save_scene_cuts(os.path.join(output_folder, SCENE_CUTS_FILE), checkpoint_scene_cuts, next_frame)
+        save_checkpoint(output_folder, {"settings": settings, "next_frame": next_frame, "complete": complete, "outputs": outputs,
+                                        "scene_cuts": checkpoint_scene_cuts})
+
+    # Replaces the checkpoint of any earlier run, whose outputs have just been overwritten
+    write_checkpoint(start_frame)
+    if os.path.exists(os.path.join(output_folder, SCENE_CUTS_FILE)):
+        os.remove(os.path.join(output_folder, SCENE_CUTS_FILE))
+
+    if workers > 1:
+        cap.release()
+        # The worker processes load the models and decode, detect and write together, so there is one stage
+        with timer.stage("detect"):
+            next_frame = detect_faces_parallel(video_path, face_writer, algorithm, cascade_path, workers, detect_interval=detect_interval,
+                                               scale=detection_scale, refine=refine, start_frame=start_frame, on_shard_done=write_checkpoint,
+                                               scene_detector=scene_detector, roi=roi, full_scan_interval=full_scan_interval)
+            face_writer.close()
+            write_checkpoint(next_frame, complete=True)
+        timer.count("frames", next_frame - start_frame)
+
+        print(f"Face detection complete. Face data saved to: {', '.join(face_writer.paths)}")
+        print(f"Found {len(scene_detector.scene_cuts)} scene cuts:", scene_detector.scene_cuts)
+        return
+
     # Get video properties
     frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
@@ -40,71 +581,91 @@ def detect_faces_in_video(video_path, output_folder="output", cascade_path="haar
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # Codec for output video
 
-    # Create output folder if it doesn't exist
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-
-    # Output video path
-    output_video_path = os.path.join(output_folder, "detection_output.mp4")
+    # Output video path; a resumed run cannot append to the first part, so it writes its own file
+    if start_frame > 0:
+        output_video_path = os.path.join(output_folder, f"detection_output_from_{start_frame}.mp4")
+    else:
+        output_video_path = os.path.join(output_folder, "detection_output.mp4")
     out = cv2.VideoWriter(output_video_path, fourcc, fps, (frame_width, frame_height))
 
-    # JSON file path
-    json_file_path = os.path.join(output_folder, "face_coordinates.json")
-    face_data = []  # List to store face detection data
-
-    frame_count = 0
+    # Initialize the chosen face detection algorithm once; it is reused for every frame
+    with timer.stage("load_models"):
+        face_detector = create_detector(algorithm, cascade_path)
+    print(f"Using {'Haar Cascade' if algorithm == 'haar' else 'RetinaFace'} for face detection.")
+    detector = IntervalDetector(face_detector, detect_interval, scale=detection_scale, refine=refine, roi=roi,
+                                full_scan_interval=full_scan_interval)
+    frame_count = start_frame
+    last_checkpoint = start_frame
+    stopped = False
 
     # Process video frames with a progress bar
-    with tqdm(total=total_frames, desc="Processing Video", unit="frame") as pbar:
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
+    with tqdm(total=total_frames, initial=start_frame, desc="Processing Video", unit="frame") as pbar:
+        while cap.isOpened() and not stopped:
+            frames = []
+            with timer.stage("decode"):
+                while len(frames) < batch_size:
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    frames.append(frame)
+            if not frames:
                 break
 
-            frame_faces = []
-
-            if algorithm == "haar":
-                # Convert to grayscale for Haar Cascade face detection
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-                # Detect faces using Haar Cascade
-                faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-                for (x, y, w, h) in faces:
-                    frame_faces.append({"x": int(x), "y": int(y), "width": int(w), "height": int(h)})
-                    if debug:
-                        cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
-
-            elif algorithm == "retinaface":
-                # Detect faces using RetinaFace
-                detections = RetinaFace.detect_faces(frame)
-                for key in detections:
-                    face = detections[key]['facial_area']
-                    x, y, x1, y1 = face
-                    frame_faces.append({"x": int(x), "y": int(y), "width": int(x1 - x), "height": int(y1 - y)})
-                    if debug:
-                        cv2.rectangle(frame, (x, y), (x1, y1), (0, 255, 0), 2)
-
-            face_data.append({"frame": frame_count, "faces": frame_faces})
-            frame_count += 1
-            out.write(frame)
-            pbar.update(1)
-
-            if debug:
-                cv2.imshow('Face Detection', frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
+            # Scene cuts are detected before the boxes are drawn onto the frames
+            with timer.stage("scene_cuts"):
+                frame_scene_cuts = [scene_detector.update(frame_count + i, frame) for i, frame in enumerate(frames)]
+            with timer.stage("detect"):
+                batch_faces = detector.detect_batch(frames, frame_scene_cuts)
+            batch_end = frame_count + len(frames)
+            for frame, frame_faces in zip(frames, batch_faces):
+                if debug:
+                    draw_faces(frame, frame_faces, face_detector.color)
+
+                with timer.stage("io"):
+                    face_writer.write(frame_count, frame_faces)
+                frame_count += 1
+                with timer.stage("write"):
+                    out.write(frame)
+                pbar.update(1)
+
+                if debug:
+                    cv2.imshow('Face Detection', frame)
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        stopped = True
+
+                # Only checkpoint where a restarted detector gives the same result as an uninterrupted run, also
+                # when stopped with 'q'. With tracking or ROI, the detector state is that of the end of the batch.
+                if (stopped or frame_count - last_checkpoint >= checkpoint_interval) and detector.detects_next_frame \
+                        and (frame_count == batch_end or (detect_interval <= 1 and not roi)):
+                    with timer.stage("io"):
+                        write_checkpoint(frame_count)
+                    last_checkpoint = frame_count
+                if stopped:
                     break
 
     # Release resources
     cap.release()
     out.release()
-    cv2.destroyAllWindows()
-
-    # Save face data to JSON file
-    with open(json_file_path, "w") as json_file:
-        json.dump(face_data, json_file, indent=4)
+    with timer.stage("io"):
+        face_writer.close()
+        if not stopped:
+            write_checkpoint(frame_count, complete=True)
+    timer.count("frames", frame_count - start_frame)
+    timer.count("detector_runs", detector.num_detections)
+    timer.count("full_scans", detector.num_full_scans)
+    timer.count("pixels_scanned", detector.pixels_scanned)
+    timer.count("pixels_total", detector.pixels_total)
+    if debug:
+        cv2.destroyAllWindows()
 
+    if detect_interval > 1:
+        print(f"Ran the detector on {detector.num_detections} of {frame_count - start_frame} frames.")
+    if roi and detector.pixels_total:
+        print(f"Scanned {100 * detector.pixels_scanned / detector.pixels_total:.1f}% of the frame pixels "
+              f"({detector.num_full_scans} full-frame scans).")
     print(f"Face detection complete. Processed video saved at: {output_video_path}")
-    print(f"Face data saved to JSON file: {json_file_path}")
+    print(f"Face data saved to: {', '.join(face_writer.paths)}")
+    print(f"Found {len(scene_detector.scene_cuts)} scene cuts:", scene_detector.scene_cuts)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Face detection on a video file.")
@@ -113,6 +674,16 @@ if __name__ == "__main__":
     parser.add_argument("--cascade_path", type=str, default="haarcascade_frontalface_default.xml", help="Path to the Haar Cascade XML file.")
     parser.add_argument("--algorithm", type=str, default="haar", choices=["haar", "retinaface"], help="Face detection algorithm to use ('haar' or 'retinaface').")
     parser.add_argument("--debug", action="store_true", help="Enable debug mode to visualize face detection.")
+    parser.add_argument("--detect_interval", type=int, default=1, help="Run the detector every N frames and track faces with optical flow in between.")
+    parser.add_argument("--detection_scale", type=float, default=1.0, help="Resize factor applied to frames before detection, e.g. 0.5.")
+    parser.add_argument("--refine", action="store_true", help="Refine downscaled detections with a full-resolution crop around each face.")
+    parser.add_argument("--roi", action="store_true", help="Detect only in windows around the previous frame's faces, with periodic full-frame scans.")
+    parser.add_argument("--full_scan_interval", type=int, default=30, help="Number of frames between two full-frame scans with --roi. Default is 30.")
+    parser.add_argument("--batch_size", type=int, default=1, help="Number of frames passed through the detector at once.")
+    parser.add_argument("--output_format", type=str, default="npy", choices=["npy", "json", "both"], help="Face coordinates format: binary face_coordinates store ('npy'), 'json' or 'both'.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of parallel detection processes (no processed video is saved if > 1).")
+    parser.add_argument("--resume", action="store_true", help="Resume an interrupted run from the checkpoint in the output folder.")
+    parser.add_argument("--checkpoint_interval", type=int, default=1000, help="Number of frames between two checkpoints. Default is 1000.")
 
     args = parser.parse_args()
 
@@ -121,5 +692,15 @@ if __name__ == "__main__":
         output_folder=args.output_folder,
         cascade_path=args.cascade_path,
         algorithm=args.algorithm,
-        debug=args.debug
+        debug=args.debug,
+        workers=args.workers,
+        detect_interval=args.detect_interval,
+        detection_scale=args.detection_scale,
+        refine=args.refine,
+        batch_size=args.batch_size,
+        output_format=args.output_format,
+        resume=args.resume,
+        checkpoint_interval=args.checkpoint_interval,
+        roi=args.roi,
+        full_scan_interval=args.full_scan_interval
     )
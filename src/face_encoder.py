@@ -0,0 +1,77 @@
+import cv2
+import dlib
+import numpy as np
+import face_recognition.api as face_api
+
+# Size and padding of the aligned face chips fed to the dlib ResNet, as in face_recognition
+CHIP_SIZE = 150
+CHIP_PADDING = 0.25
+# Identifies the encodings produced here, so cached encodings are not reused across models
+ENCODER_MODEL = f"dlib_face_recognition_resnet_model_v1-5_point-chip{CHIP_SIZE}-padding{CHIP_PADDING}"
+
+
+def face_chip(frame, face):
+    """
+    Crop a detected face from a BGR frame and return its aligned RGB chip.
+
+    This matches face_recognition.face_encodings(crop, [(0, w, h, 0)], model="small"), which
+    locates 5 landmarks inside the crop and aligns the face before encoding.
+
+    Args:
+        frame (numpy.ndarray): The BGR frame.
+        face (dict): Face box with "x", "y", "width" and "height" keys.
+
+    Returns:
+        numpy.ndarray: The aligned CHIP_SIZE x CHIP_SIZE RGB face chip.
+    """
+    x, y, w, h = face['x'], face['y'], face['width'], face['height']
+
+    # face_recognition library requires RGB format, openCV uses BGR
+    cropped_face_rgb = cv2.cvtColor(frame[y:y+h, x:x+w], cv2.COLOR_BGR2RGB)
+
+    landmarks = face_api.pose_predictor_5_point(cropped_face_rgb, dlib.rectangle(0, 0, w, h))
+    return dlib.get_face_chip(cropped_face_rgb, landmarks, size=CHIP_SIZE, padding=CHIP_PADDING)
+
+
+def encode_chips(chips):
+    """
+    Compute 128-d face descriptors for a list of aligned chips in one batched call.
+    """
+    if not chips:
+        return np.empty((0, 128))
+    return np.array(face_api.face_encoder.compute_face_descriptor(chips))
+
+
+class BatchFaceEncoder:
+    """
+    Collect face chips from many frames and encode them in batches.
+
+    Args:
+        batch_size (int): Number of faces encoded per batched descriptor call.
+    """
+
+    def __init__(self, batch_size=64):
+        self.batch_size = batch_size
+        self.keys = []
+        self.chips = []
+        self.num_faces = 0
+        self.num_batches = 0
+
+    def add(self, key, frame, face):
+        """
+        Queue a face for encoding. Returns True once a full batch is waiting to be flushed.
+        """
+        self.keys.append(key)
+        self.chips.append(face_chip(frame, face))
+        return len(self.chips) >= self.batch_size
+
+    def flush(self):
+        """
+        Encode all queued faces and return (keys, encodings) in the order they were added.
+        """
+        keys, chips = self.keys, self.chips
+        self.keys, self.chips = [], []
+        if chips:
+            self.num_faces += len(chips)
+            self.num_batches += 1
+        return keys, encode_chips(chips)
@@ -1,30 +1,27 @@
 import cv2
 import json
-import face_recognition
-from scipy.spatial import distance
 import os
 import argparse
 from tqdm import tqdm
-from moviepy.video.io.VideoFileClip import VideoFileClip
 import numpy as np
-
-
-def load_face_coordinates(file_path):
-    with open(file_path, 'r') as file:
-        return json.load(file)
-
-
-def encode_reference_image(reference_image_path):
-    reference_image = face_recognition.load_image_file(reference_image_path)
-    return face_recognition.face_encodings(reference_image)[0]
-
-
-def group_consecutive_frames(frames):
+from frame_source import FrameReader
+from segment_writer import write_segments
+from face_encoder import BatchFaceEncoder, face_chip, encode_chips
+from face_store import load_face_coordinates
+from gallery import load_gallery
+from embedding_cache import EmbeddingCache
+from profiling import StageTimer
+from smoothing import smooth_segment
+from scene_detection import SceneCutDetector, load_scene_cuts, scene_cuts_path
+from tracking import IouTracker, Track
+
+
+def group_consecutive_frames(frames, scene_cuts=()):
     segments = []
     current_segment = []
 
     for i, frame in enumerate(frames):
-        if i == 0 or frame[0] == frames[i - 1][0] + 1:
+        if i == 0 or (frame[0] == frames[i - 1][0] + 1 and frame[0] not in scene_cuts):
             current_segment.append(frame)
         else:
             segments.append(current_segment)
@@ -36,181 +33,298 @@ def group_consecutive_frames(frames):
     return segments
 
 
-def smooth_bounding_boxes(segment, smoothing_window=5):
-    smoothed_segment = []
-    boxes = np.array([box for _, box in segment])
+def save_video(video_path, segment, output_path, fps):
+    write_segments(video_path, [segment], [output_path], fps)
 
-    # Apply moving average for each coordinate
-    smoothed_x = np.convolve(boxes[:, 0], np.ones(smoothing_window) / smoothing_window, mode='same')
-    smoothed_y = np.convolve(boxes[:, 1], np.ones(smoothing_window) / smoothing_window, mode='same')
-    smoothed_w = np.convolve(boxes[:, 2], np.ones(smoothing_window) / smoothing_window, mode='same')
-    smoothed_h = np.convolve(boxes[:, 3], np.ones(smoothing_window) / smoothing_window, mode='same')
+def save_video_with_audio(video_path, segment, output_path, fps):
+    write_segments(video_path, [segment], [output_path], fps, backend="ffmpeg", audio=True)
 
-    for i, (frame_index, _) in enumerate(segment):
-        smoothed_segment.append((frame_index, (int(smoothed_x[i]), int(smoothed_y[i]), int(smoothed_w[i]), int(smoothed_h[i]))))
 
-    return smoothed_segment
+def select_matches(scored_faces, match_threshold, frame_index=None, debug=False, names=None):
+    """
+    Match the faces of a frame to the gallery identities.
 
+    Each face is assigned to its closest identity if that distance is below `match_threshold`,
+    and each identity takes the first face assigned to it in detection order.
 
-def save_video(video_path, segment, output_path, fps):
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    final_w = sum([w for _, (_, _, w, _) in segment]) // len(segment)
-    final_h = sum([h for _, (_, _, _, h) in segment]) // len(segment)
-    out = cv2.VideoWriter(output_path, fourcc, fps, (final_w, final_h))
-
-    video_capture = cv2.VideoCapture(video_path)
-
-    for frame_index, (x, y, w, h) in tqdm(segment, desc="Saving video segment"):
-        video_capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
-        ret, frame = video_capture.read()
-        if ret:
-            cropped_face = frame[y:y+h, x:x+w]
-            cropped_face = cv2.resize(cropped_face, (final_w, final_h))
-            out.write(cropped_face)
-
-    out.release()
-    video_capture.release()
+    Args:
+        scored_faces (list): (box, distances) pairs in detection order, with the distances of the face to each identity.
+        match_threshold (float): Threshold for face matching.
+        names (list): Identity names, used in the debug output.
 
-def save_video_with_audio(video_path, segment, output_path, fps):
-    temp_output = "temp_video.mp4"
+    Returns:
+        dict: Identity index -> matched (x, y, w, h) box.
+    """
+    matches = {}
+    for i, (box, distances) in enumerate(scored_faces):
+        distances = np.atleast_1d(distances)
+        identity = int(np.argmin(distances))
+        if debug:
+            name = f" ({names[identity]})" if names is not None and len(names) > 1 else ""
+            print(f"Frame {frame_index}: Face {i + 1} - Distance: {distances[identity]}{name}")
 
-    # Initialize VideoWriter
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    final_w = sum([w for _, (_, _, w, _) in segment]) // len(segment)
-    final_h = sum([h for _, (_, _, _, h) in segment]) // len(segment)
-    out = cv2.VideoWriter(temp_output, fourcc, fps, (final_w, final_h))
+        # Check if the face matches a reference identity
+        if distances[identity] < match_threshold and identity not in matches:
+            matches[identity] = box
 
-    video_capture = cv2.VideoCapture(video_path)
+    return matches
 
-    for frame_index, (x, y, w, h) in tqdm(segment, desc="Saving video segment"):
-        video_capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
-        ret, frame = video_capture.read()
-        if ret:
-            cropped_face = frame[y:y+h, x:x+w]
-            cropped_face = cv2.resize(cropped_face, (final_w, final_h))
-            out.write(cropped_face)
 
-    out.release()
-    video_capture.release()
+def match_faces(frame, faces, gallery, match_threshold, frame_index=None, debug=False):
+    """
+    Return the boxes of the faces in `faces` that match the gallery identities, as {identity index: (x, y, w, h)}.
+    """
+    if not faces:
+        return {}
 
-    # Extract audio and merge it with the video segment
-    start_time = segment[0][0] / fps
-    end_time = segment[-1][0] / fps
-    with VideoFileClip(video_path) as video:
-        clip = video.subclipped(start_time, min(end_time, video.duration))
+    # All faces of the frame are encoded in one batch and scored against all identities in one distance computation
+    encodings = encode_chips([face_chip(frame, face) for face in faces])
+    boxes = [(face['x'], face['y'], face['width'], face['height']) for face in faces]
+    return select_matches(zip(boxes, gallery.distances(encodings)), match_threshold, frame_index, debug, gallery.names)
 
-    with VideoFileClip(temp_output) as video_clip:
-        video_clip.audio = clip.audio
-        video_clip.write_videofile(output_path, codec="libx264", audio_codec="aac")
 
-    os.remove(temp_output)
+def identity_output_dir(output_dir, gallery, identity):
+    """
+    Return the output directory of an identity: `output_dir` itself for a single identity, else a subdirectory per identity.
+    """
+    if len(gallery) == 1:
+        return output_dir
+    return os.path.join(output_dir, gallery.names[identity])
 
 
-def process_video(video_path, face_coordinates, reference_encoding, output_dir, match_threshold, debug):
-    video_capture = cv2.VideoCapture(video_path)
+def process_video(video_path, face_coordinates, gallery, output_dir, match_threshold, debug, batch_size=64,
+                  track=False, sample_interval=30, max_samples=3, backend="opencv", audio=False, embedding_cache_dir=None,
+                  scene_cuts=None, timer=None):
+    # The time spent in each stage is recorded in `timer` (see benchmark.py)
+    timer = timer if timer is not None else StageTimer()
+    # face_coordinates is ordered by frame, so frames are decoded sequentially instead of seeked
+    video_capture = FrameReader(video_path)
 
-    matched_frames = []
+    matched_frames = [[] for _ in range(len(gallery))]
     frame_height = int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
     frame_width = int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
-    fps = int(video_capture.get(cv2.CAP_PROP_FPS))
+    fps = video_capture.get(cv2.CAP_PROP_FPS)
+
+    # Faces from many frames are encoded together and scored in one vectorized distance computation
+    encoder = BatchFaceEncoder(batch_size)
+    # In track mode, faces are linked into tracks and only a few frames per track are encoded.
+    # Otherwise every face is its own single-frame track.
+    tracker = IouTracker()
+    frame_tracks = {}  # frame_index -> [(box, track_id)] in detection order
+    track_distances = {}  # track_id -> distances of the encoded samples to each identity
+    next_track_id = 0
+    debug_crops = {}
+
+    # Encodings of earlier runs on the same video and faces are reused from the embedding cache.
+    # Frames are only decoded for faces that still need encoding (and for debug crops).
+    cache = EmbeddingCache(embedding_cache_dir, video_path, face_coordinates) if embedding_cache_dir else None
+    if scene_cuts is None and cache is not None:
+        scene_cuts = cache.scene_cuts
+    # Without the cuts from face detection or the cache, they are found on the decoded frames with faces.
+    # Cuts matter only between two consecutive frames with faces, so no other frame is decoded for them.
+    scene_detector = SceneCutDetector() if scene_cuts is None else None
+    scene_cuts = set(scene_cuts or ())
+    cached_samples = []  # (track_id, row) of samples whose encoding is in the cache
+    face_row = 0  # Row of the next face in the embedding cache
+
+    def score_batch():
+        with timer.stage("encode"):
+            keys, encodings = encoder.flush()
+        if cache is not None and keys:
+            with timer.stage("io"):
+                cache.put([row for _, row in keys], encodings)
+        with timer.stage("match"):
+            for (track_id, _), distances in zip(keys, gallery.distances(encodings)):
+                track_distances.setdefault(track_id, []).append(distances)
 
     for face_data in (face_coordinates if debug else tqdm(face_coordinates, desc="Processing frames")):
         frame_index = face_data['frame']
         faces = face_data['faces']
-
-        # Capture the specific frame from the video
-        video_capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
-        ret, frame = video_capture.read()
-        if not ret:
-            print(f"Failed to read frame {frame_index}")
+        rows = range(face_row, face_row + len(faces))
+        face_row += len(faces)
+        if not faces:
             continue
 
-        for i, face in enumerate(faces):
-            x, y, w, h = face['x'], face['y'], face['width'], face['height']
-
-            # Crop the face from the frame
-            cropped_face = frame[y:y+h, x:x+w]
-
-            # face_recognition library requires RGB format, openCV uses BGR
-            cropped_face_rgb = cv2.cvtColor(cropped_face, cv2.COLOR_BGR2RGB)
-
-            face_encodings = face_recognition.face_encodings(cropped_face_rgb, [(0, w, h, 0)], model="small")
-            if face_encodings:
-                face_encoding = face_encodings[0]
-                face_distance = distance.euclidean(reference_encoding, face_encoding)
-
-                if debug:
-                    print(f"Frame {frame_index}: Face {i + 1} - Distance: {face_distance}")
-
-                # Check if the face matches the reference image
-                if face_distance < match_threshold:
-                    matched_frames.append((frame_index, (x, y, w, h)))
-
-                    # Save the cropped face for debugging if enabled
-                    if debug:
-                        debug_path = os.path.join(output_dir, "debug")
-                        os.makedirs(debug_path, exist_ok=True)
-                        debug_file = os.path.join(debug_path, f"frame_{frame_index}.png")
-                        cv2.imwrite(debug_file, cropped_face)
-
-                    break
-
-    segments = group_consecutive_frames(matched_frames)
-
-    print(f"Detected {len(segments)} face segments:", [len(segment) for segment in segments])
-
-    metadata = {'file_name': video_path, 'segments': []}
-    # Save each segment as a video with audio
-    for idx, segment in enumerate(segments):
-        segment = smooth_bounding_boxes(segment)
+        frame = None
+        if scene_detector is not None:
+            # Capture the specific frame from the video
+            with timer.stage("decode"):
+                ret, frame = video_capture.read(frame_index)
+            if not ret:
+                print(f"Failed to read frame {frame_index}")
+                continue
+            with timer.stage("scene_cuts"):
+                if scene_detector.update(frame_index, frame):
+                    scene_cuts.add(frame_index)
+
+        boxes = [(face['x'], face['y'], face['width'], face['height']) for face in faces]
+        if track:
+            tracks = tracker.update(frame_index, boxes, frame_index in scene_cuts)
+        else:
+            tracks = [Track(next_track_id + i, frame_index, box) for i, box in enumerate(boxes)]
+            next_track_id += len(boxes)
 
-        # Generate metadata for the segment
-        start_time = segment[0][0] / fps
-        end_time = segment[-1][0] / fps
-        metadata['segments'].append({
-            "start_time": start_time,
-            "end_time": end_time,
-            "face_coordinates": segment
-        })
+        samples = [(face, face_track, row) for face, face_track, row in zip(faces, tracks, rows)
+                   if face_track.needs_sample(sample_interval, max_samples)]
 
-        output_path = os.path.join(output_dir, f"segment_{idx + 1}.mp4")
-        # save_video_with_audio(video_path, segment, output_path, fps)
-        save_video(video_path, segment, output_path, fps)
+        if frame is None and (debug or any(cache is None or not cache.computed[row] for _, _, row in samples)):
+            with timer.stage("decode"):
+                ret, frame = video_capture.read(frame_index)
+            if not ret:
+                print(f"Failed to read frame {frame_index}")
+                continue
 
+        frame_tracks[frame_index] = [(box, face_track.track_id) for box, face_track in zip(boxes, tracks)]
         if debug:
-            print(f"Segment {idx + 1} contains {len(segment)} frames at {fps} FPS.")
+            for x, y, w, h in boxes:
+                debug_crops[(frame_index, (x, y, w, h))] = frame[y:y+h, x:x+w].copy()
+        for face, face_track, row in samples:
+            # Counted only once the sample is queued, so a failed frame read does not use up a track's samples
+            face_track.num_samples += 1
+            if cache is not None and cache.computed[row]:
+                cached_samples.append((face_track.track_id, row))
+            else:
+                with timer.stage("encode"):
+                    batch_full = encoder.add((face_track.track_id, row), frame, face)
+                if batch_full:
+                    score_batch()
+
+    score_batch()
+    video_capture.release()
 
-        print(f"Saved video segment to {output_path}")
-    
-    # Save metadata to JSON file
-    metadata_path = os.path.join(output_dir, "metadata.json")
-    with open(metadata_path, "w") as file:
-        json.dump(metadata, file, indent=4)
+    if cached_samples:
+        # Re-matching cached encodings is a single distance computation
+        track_ids, rows = zip(*cached_samples)
+        with timer.stage("match"):
+            for track_id, distances in zip(track_ids, gallery.distances(cache.embeddings[list(rows)])):
+                track_distances.setdefault(track_id, []).append(distances)
+    timer.count("embeddings", encoder.num_faces)
+    timer.count("cached_embeddings", len(cached_samples))
+    if cache is not None:
+        with timer.stage("io"):
+            cache.flush()
+            if scene_detector is not None:
+                cache.scene_cuts = scene_cuts
+        print(f"Reused {len(cached_samples)} cached face encodings and encoded {encoder.num_faces} faces "
+              f"(cache: {cache.path}).")
+
+    if track:
+        print(f"Encoded {encoder.num_faces + len(cached_samples)} faces from {len(track_distances)} tracks.")
+
+    # A track matches by the median distance of its samples, and all its frames inherit the result
+    track_distances = {track_id: np.median(distances, axis=0) for track_id, distances in track_distances.items()}
+    for frame_index, faces in frame_tracks.items():
+        scored_faces = [(box, track_distances[track_id]) for box, track_id in faces if track_id in track_distances]
+        with timer.stage("match"):
+            matches = select_matches(scored_faces, match_threshold, frame_index, debug, gallery.names)
+        for identity, match in matches.items():
+            matched_frames[identity].append((frame_index, match))
+
+            # Save the cropped face for debugging if enabled
+            if debug:
+                debug_path = os.path.join(identity_output_dir(output_dir, gallery, identity), "debug")
+                os.makedirs(debug_path, exist_ok=True)
+                debug_file = os.path.join(debug_path, f"frame_{frame_index}.png")
+                cv2.imwrite(debug_file, debug_crops[(frame_index, match)])
+
+    identity_segments = []
+    for identity in range(len(gallery)):
+        segments = group_consecutive_frames(matched_frames[identity], scene_cuts)
+        name = f" of {gallery.names[identity]}" if len(gallery) > 1 else ""
+        print(f"Detected {len(segments)} face segments{name}:", [len(segment) for segment in segments])
+        identity_segments.append([smooth_segment(segment, (frame_width, frame_height)) for segment in segments])
+
+    all_segments, output_paths = [], []
+    for identity, segments in enumerate(identity_segments):
+        identity_dir = identity_output_dir(output_dir, gallery, identity)
+        os.makedirs(identity_dir, exist_ok=True)
+        all_segments += segments
+        output_paths += [os.path.join(identity_dir, f"segment_{idx + 1}.mp4") for idx in range(len(segments))]
+
+    # The segments of all identities are written in one sequential decode of the video
+    with timer.stage("write"):
+        write_segments(video_path, all_segments, output_paths, fps, backend, audio)
+
+    for identity, segments in enumerate(identity_segments):
+        identity_dir = identity_output_dir(output_dir, gallery, identity)
+        metadata = {'file_name': video_path, 'segments': []}
+        for idx, segment in enumerate(segments):
+            # Generate metadata for the segment
+            start_time = segment[0][0] / fps
+            end_time = segment[-1][0] / fps
+            metadata['segments'].append({
+                "start_time": start_time,
+                "end_time": end_time,
+                "face_coordinates": segment
+            })
+
+            if debug:
+                print(f"Segment {idx + 1} contains {len(segment)} frames at {fps:g} FPS.")
+
+            print(f"Saved video segment to {os.path.join(identity_dir, f'segment_{idx + 1}.mp4')}")
+
+        # Save metadata to JSON file
+        metadata_path = os.path.join(identity_dir, "metadata.json")
+        with timer.stage("io"), open(metadata_path, "w") as file:
+            json.dump(metadata, file, indent=4)
 
 
 def main():
     parser = argparse.ArgumentParser(description="Process a video to extract matched face segments.")
     parser.add_argument("--video_path", type=str, required=True, help="Path to the input video file.")
-    parser.add_argument("--face_coordinates_path", type=str, required=True, help="Path to the face detection JSON file.")
-    parser.add_argument("--reference_image_path", type=str, required=True, help="Path to the reference image file.")
+    parser.add_argument("--face_coordinates_path", type=str, required=True, help="Path to the face_coordinates store directory or JSON file.")
+    references = parser.add_mutually_exclusive_group(required=True)
+    references.add_argument("--reference_image_path", type=str, nargs="+", help="Path to one or more reference images of the target face.")
+    references.add_argument("--gallery_dir", type=str, help="Directory with one subdirectory of reference images (or one image) per target.")
     parser.add_argument("--output_dir", type=str, required=True, help="Directory to save the output video segments.")
     parser.add_argument("--match_threshold", type=float, default=0.7, help="Threshold for face matching. Default is 0.7.")
+    parser.add_argument("--batch_size", type=int, default=64, help="Number of faces encoded per batch. Default is 64.")
+    parser.add_argument("--track", action="store_true", help="Link faces into tracks and only recognize a few sampled frames per track.")
+    parser.add_argument("--sample_interval", type=int, default=30, help="Frames between recognized samples of a track. Default is 30.")
+    parser.add_argument("--max_samples", type=int, default=3, help="Maximum number of recognized samples per track. Default is 3.")
+    parser.add_argument("--backend", type=str, default="opencv", choices=["opencv", "ffmpeg"], help="Segment encoder: OpenCV mp4v or an ffmpeg pipe with libx264.")
+    parser.add_argument("--audio", action="store_true", help="Copy the audio of each segment from the source video (requires --backend ffmpeg).")
+    parser.add_argument("--embedding_cache_dir", type=str, default=None, help="Directory of the face encoding cache. Default is 'embeddings' next to the face coordinates.")
+    parser.add_argument("--no_embedding_cache", action="store_true", help="Encode all faces without reading or writing the face encoding cache.")
     parser.add_argument("--debug", action="store_true", help="Enable debug mode to save matching faces as images.")
 
     args = parser.parse_args()
+    if args.audio and args.backend != "ffmpeg":
+        parser.error("--audio requires --backend ffmpeg")
+    if args.max_samples < 1:
+        parser.error("--max_samples must be at least 1")
 
     os.makedirs(args.output_dir, exist_ok=True)
 
+    gallery = load_gallery(args.gallery_dir, args.reference_image_path)
+    if len(gallery) == 0:
+        print("Error: No face found in the reference images.")
+        return
     face_coordinates = load_face_coordinates(args.face_coordinates_path)
-    reference_encoding = encode_reference_image(args.reference_image_path)
+    # Scene cuts saved by face_detection.py are used instead of detecting them again
+    scene_cuts = load_scene_cuts(scene_cuts_path(args.face_coordinates_path))
+    if scene_cuts is not None:
+        print(f"Loaded {len(scene_cuts)} scene cuts from {scene_cuts_path(args.face_coordinates_path)}")
+    embedding_cache_dir = args.embedding_cache_dir
+    if embedding_cache_dir is None and not args.no_embedding_cache:
+        face_coordinates_dir = os.path.dirname(os.path.abspath(args.face_coordinates_path))
+        embedding_cache_dir = os.path.join(face_coordinates_dir, "embeddings")
 
     process_video(
         video_path=args.video_path,
         face_coordinates=face_coordinates,
-        reference_encoding=reference_encoding,
+        gallery=gallery,
         output_dir=args.output_dir,
         match_threshold=args.match_threshold,
-        debug=args.debug
+        debug=args.debug,
+        batch_size=args.batch_size,
+        track=args.track,
+        sample_interval=args.sample_interval,
+        max_samples=args.max_samples,
+        backend=args.backend,
+        audio=args.audio,
+        embedding_cache_dir=None if args.no_embedding_cache else embedding_cache_dir,
+        scene_cuts=scene_cuts
     )
 
 
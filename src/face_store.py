@@ -0,0 +1,257 @@
+import os
+import json
+import struct
+import argparse
+import textwrap
+import numpy as np
+
+# Columns of the binary face coordinates store, one value per detected face
+FACE_COLUMNS = {
+    "frame": np.int64,
+    "x": np.int32,
+    "y": np.int32,
+    "width": np.int32,
+    "height": np.int32,
+    "score": np.float32,
+}
+# offsets[f]:offsets[f + 1] are the rows of the faces detected in frame f
+OFFSETS_COLUMN = "offsets"
+
+# Fixed .npy header size, so the header can be rewritten in place when the column grows
+_HEADER_SIZE = 128
+
+
+def _npy_header(dtype, length):
+    descr = np.lib.format.dtype_to_descr(np.dtype(dtype))
+    header = f"{{'descr': {descr!r}, 'fortran_order': False, 'shape': ({length},), }}"
+    header = header.ljust(_HEADER_SIZE - 11) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+class _ColumnWriter:
+    """
+    Append-only writer of a 1-D .npy file that stays loadable (and memory-mappable) after every flush.
+
+    With `length`, an existing column is reopened and truncated to its first `length` values.
+    """
+
+    def __init__(self, path, dtype, length=None):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        if length is None:
+            self.length = 0
+            self.file = open(path, "wb")
+            self.file.write(_npy_header(self.dtype, 0))
+        else:
+            self.length = length
+            self.file = open(path, "r+b")
+            self.file.truncate(_HEADER_SIZE + length * self.dtype.itemsize)
+            self.file.seek(0, os.SEEK_END)
+
+    def append(self, values):
+        values = np.asarray(values, dtype=self.dtype)
+        self.file.write(values.tobytes())
+        self.length += len(values)
+
+    def flush(self):
+        position = self.file.tell()
+        self.file.seek(0)
+        self.file.write(_npy_header(self.dtype, self.length))
+        self.file.seek(position)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class NpyFaceWriter:
+    """
+    Stream frame-wise face data into a directory of columnar .npy files.
+
+    Args:
+        path (str): Directory of the store.
+        state (dict): State returned by `state()` to resume an existing store from, or None to start a new one.
+    """
+
+    def __init__(self, path, state=None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.num_frames = state["num_frames"] if state else 0
+        self.num_faces = state["num_faces"] if state else 0
+        face_rows = self.num_faces if state else None
+        self.columns = {name: _ColumnWriter(os.path.join(path, f"{name}.npy"), dtype, face_rows) for name, dtype in FACE_COLUMNS.items()}
+        self.offsets = _ColumnWriter(os.path.join(path, f"{OFFSETS_COLUMN}.npy"), np.int64, self.num_frames + 1 if state else None)
+        if not state:
+            self.offsets.append([0])
+
+    def write(self, frame_index, faces):
+        # Frames without an entry get an empty offset range
+        if frame_index > self.num_frames:
+            self.offsets.append([self.num_faces] * (frame_index - self.num_frames))
+            self.num_frames = frame_index
+
+        if faces:
+            self.columns["frame"].append([frame_index] * len(faces))
+            for name in ("x", "y", "width", "height"):
+                self.columns[name].append([face[name] for face in faces])
+            self.columns["score"].append([face.get("score", np.nan) for face in faces])
+            self.num_faces += len(faces)
+
+        self.offsets.append([self.num_faces])
+        self.num_frames += 1
+
+    def flush(self):
+        for column in self.columns.values():
+            column.flush()
+        self.offsets.flush()
+
+    def state(self):
+        return {"num_frames": self.num_frames, "num_faces": self.num_faces}
+
+    def close(self):
+        for column in self.columns.values():
+            column.close()
+        self.offsets.close()
+
+
+class JsonFaceWriter:
+    """
+    Stream frame-wise face data into a JSON file with the same layout as json.dump(face_data, indent=4).
+
+    Args:
+        path (str): Path of the JSON file.
+        state (dict): State returned by `state()` to resume an unfinished file from, or None to start a new one.
+    """
+
+    def __init__(self, path, state=None):
+        self.path = path
+        if state:
+            # Drop anything written after the state was taken
+            self.file = open(path, "r+")
+            self.file.truncate(state["size"])
+            self.file.seek(state["size"])
+            self.num_frames = state["num_frames"]
+        else:
+            self.file = open(path, "w")
+            self.num_frames = 0
+
+    def write(self, frame_index, faces):
+        entry = {"frame": frame_index, "faces": [{key: face[key] for key in ("x", "y", "width", "height")} for face in faces]}
+        self.file.write("[\n" if self.num_frames == 0 else ",\n")
+        self.file.write(textwrap.indent(json.dumps(entry, indent=4), "    "))
+        self.num_frames += 1
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def state(self):
+        return {"num_frames": self.num_frames, "size": self.file.tell()}
+
+    def close(self):
+        self.file.write("\n]" if self.num_frames else "[]")
+        self.file.close()
+
+
+class FaceDataWriter:
+    """
+    Write frame-wise face data to face_coordinates.json and/or the binary face_coordinates store.
+
+    Args:
+        output_folder (str): Folder to save the face coordinates in.
+        output_format (str): "json", "npy" or "both".
+        state (dict): State returned by `checkpoint()` to resume the outputs from, or None to start new ones.
+    """
+
+    def __init__(self, output_folder, output_format="npy", state=None):
+        self.writers = []
+        if output_format in ("npy", "both"):
+            self.writers.append(NpyFaceWriter(os.path.join(output_folder, "face_coordinates"), state and state["npy"]))
+        if output_format in ("json", "both"):
+            self.writers.append(JsonFaceWriter(os.path.join(output_folder, "face_coordinates.json"), state and state["json"]))
+
+    @property
+    def paths(self):
+        return [writer.path for writer in self.writers]
+
+    def write(self, frame_index, faces):
+        for writer in self.writers:
+            writer.write(frame_index, faces)
+
+    def flush(self):
+        for writer in self.writers:
+            writer.flush()
+
+    def checkpoint(self):
+        """
+        Flush all outputs to disk and return the state to resume them from.
+        """
+        self.flush()
+        return {"npy" if isinstance(writer, NpyFaceWriter) else "json": writer.state() for writer in self.writers}
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+
+class FaceCoordinatesReader:
+    """
+    Lazy, memory-mapped reader of a binary face coordinates store.
+
+    Iterating yields the same {"frame", "faces"} entries as face_coordinates.json.
+
+    Args:
+        path (str): Directory of the store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in FACE_COLUMNS}
+        self.offsets = np.load(os.path.join(path, f"{OFFSETS_COLUMN}.npy"))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, frame_index):
+        start, end = self.offsets[frame_index], self.offsets[frame_index + 1]
+        x, y = self.columns["x"][start:end], self.columns["y"][start:end]
+        w, h = self.columns["width"][start:end], self.columns["height"][start:end]
+        faces = [{"x": int(x[i]), "y": int(y[i]), "width": int(w[i]), "height": int(h[i])} for i in range(end - start)]
+        return {"frame": frame_index, "faces": faces}
+
+    def __iter__(self):
+        for frame_index in range(len(self)):
+            yield self[frame_index]
+
+
+def load_face_coordinates(path):
+    """
+    Load face coordinates from a face_coordinates.json file or lazily from a binary store directory.
+    """
+    if os.path.isdir(path):
+        return FaceCoordinatesReader(path)
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def export_json(store_path, json_path):
+    """
+    Convert a binary face coordinates store to face_coordinates.json without loading it at once.
+    """
+    writer = JsonFaceWriter(json_path)
+    for entry in FaceCoordinatesReader(store_path):
+        writer.write(entry["frame"], entry["faces"])
+    writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a binary face coordinates store to JSON.")
+    parser.add_argument("--store_path", type=str, required=True, help="Path to the face_coordinates store directory.")
+    parser.add_argument("--json_path", type=str, required=True, help="Path to save the face_coordinates.json file.")
+
+    args = parser.parse_args()
+
+    export_json(args.store_path, args.json_path)
+    print(f"Face data saved to JSON file: {args.json_path}")
@@ -0,0 +1,52 @@
+import cv2
+
+# Largest forward gap (in frames) that is bridged by decoding and discarding frames.
+# Seeking re-decodes from the previous keyframe, so for short gaps grabbing is cheaper.
+DEFAULT_MAX_SKIP = 120
+
+
+class FrameReader:
+    """
+    Read frames from a video in increasing frame order with a single sequential decode.
+
+    Frames are decoded in order and only seeked to when the requested frame lies behind the
+    current position or further ahead than `max_skip` frames.
+
+    Args:
+        video_path (str): Path to the input video file.
+        max_skip (int): Largest forward gap that is bridged with grab() instead of a seek.
+    """
+
+    def __init__(self, video_path, max_skip=DEFAULT_MAX_SKIP):
+        self.capture = cv2.VideoCapture(video_path)
+        self.max_skip = max_skip
+        self.position = 0  # Index of the frame the next read() returns, None if unknown
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def get(self, prop_id):
+        return self.capture.get(prop_id)
+
+    def read(self, frame_index):
+        """
+        Return (ret, frame) for `frame_index`, like cv2.VideoCapture.read().
+        """
+        if self.position is None or not 0 <= frame_index - self.position <= self.max_skip:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+            self.position = frame_index
+
+        # Decode without converting the skipped frames
+        while self.position < frame_index:
+            if not self.capture.grab():
+                self.position = None
+                return False, None
+            self.position += 1
+
+        ret, frame = self.capture.read()
+        # After a failed read the decoder position is unknown, so the next read seeks
+        self.position = self.position + 1 if ret else None
+        return ret, frame
+
+    def release(self):
+        self.capture.release()
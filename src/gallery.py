@@ -0,0 +1,164 @@
+import os
+import argparse
+import numpy as np
+import face_recognition
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp")
+# Cache of the encoded gallery, saved in the gallery directory
+CACHE_FILE = "gallery_cache.npz"
+# Number of face encodings compared with the references at once
+DISTANCE_CHUNK_SIZE = 1024
+
+
+def encode_face_image(image_path):
+    """
+    Return the encoding of the largest face in an image, or None if no face is found.
+    """
+    image = face_recognition.load_image_file(image_path)
+    locations = face_recognition.face_locations(image)
+    if not locations:
+        return None
+    largest = max(locations, key=lambda location: (location[2] - location[0]) * (location[1] - location[3]))
+    return face_recognition.face_encodings(image, [largest])[0]
+
+
+def list_gallery_images(gallery_dir):
+    """
+    List the reference images of a gallery directory.
+
+    Each subdirectory is an identity with any number of reference images. An image directly in
+    the gallery directory is an identity of its own, named after the file.
+
+    Returns:
+        dict: Identity name -> sorted list of image paths.
+    """
+    identity_images = {}
+    for entry in sorted(os.listdir(gallery_dir)):
+        path = os.path.join(gallery_dir, entry)
+        if os.path.isdir(path):
+            images = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.lower().endswith(IMAGE_EXTENSIONS)]
+            if images:
+                identity_images[entry] = images
+        elif entry.lower().endswith(IMAGE_EXTENSIONS):
+            identity_images[os.path.splitext(entry)[0]] = [path]
+    return identity_images
+
+
+def _fingerprint(identity_images):
+    # Identifies the gallery contents, so the cache is rebuilt when an image is added, removed or changed
+    return np.array([f"{name}|{os.path.abspath(path)}|{os.path.getsize(path)}|{os.path.getmtime(path)}"
+                     for name, paths in sorted(identity_images.items()) for path in paths])
+
+
+class FaceGallery:
+    """
+    Reference encodings of one or more identities, with any number of encodings per identity.
+
+    Args:
+        names (list): Identity names.
+        encodings (np.ndarray): (K, 128) reference encodings.
+        labels (np.ndarray): (K,) index into `names` of each encoding. Every identity needs at least one encoding.
+    """
+
+    def __init__(self, names, encodings, labels):
+        # References are grouped by identity so that a distance matrix can be reduced per identity
+        order = np.argsort(labels, kind="stable")
+        self.names = list(names)
+        self.encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, 128)[order]
+        self.labels = np.asarray(labels, dtype=np.int64)[order]
+        self.starts = np.searchsorted(self.labels, np.arange(len(self.names)))
+
+    def __len__(self):
+        return len(self.names)
+
+    def distances(self, encodings):
+        """
+        Return the (N, M) distances of N face encodings to the closest reference of each of the M identities.
+        """
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, 128)
+        results = [np.empty((0, len(self.names)))]
+        # Chunked so that the (chunk, K, 128) difference array stays small for many faces
+        for start in range(0, len(encodings), DISTANCE_CHUNK_SIZE):
+            chunk = encodings[start:start + DISTANCE_CHUNK_SIZE]
+            distances = np.linalg.norm(chunk[:, None, :] - self.encodings[None, :, :], axis=2)
+            results.append(np.minimum.reduceat(distances, self.starts, axis=1))
+        return np.concatenate(results)
+
+    def save(self, path, fingerprint=()):
+        # Written under a per-process name and renamed, so a concurrent reader never sees a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(file, names=np.array(self.names), encodings=self.encodings, labels=self.labels,
+                     fingerprint=np.asarray(fingerprint, dtype=str))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls([str(name) for name in data["names"]], data["encodings"], data["labels"]), data["fingerprint"]
+
+
+def build_gallery(identity_images, cache_path=None):
+    """
+    Encode the reference images of each identity, reusing the cache at `cache_path` if its images are unchanged.
+
+    Args:
+        identity_images (dict): Identity name -> list of reference image paths.
+        cache_path (str): Path of the .npz cache, or None to always encode the images.
+
+    Returns:
+        FaceGallery: The gallery. Identities without any detectable face are left out.
+    """
+    fingerprint = _fingerprint(identity_images)
+    if cache_path is not None and os.path.exists(cache_path):
+        gallery, cached_fingerprint = FaceGallery.load(cache_path)
+        if np.array_equal(cached_fingerprint, fingerprint):
+            return gallery
+
+    names, encodings, labels = [], [], []
+    for name, paths in sorted(identity_images.items()):
+        identity_encodings = []
+        for path in paths:
+            encoding = encode_face_image(path)
+            if encoding is None:
+                print(f"Warning: No face found in reference image {path}")
+                continue
+            identity_encodings.append(encoding)
+        if not identity_encodings:
+            print(f"Warning: Skipping identity '{name}' without any usable reference image.")
+            continue
+        labels += [len(names)] * len(identity_encodings)
+        encodings += identity_encodings
+        names.append(name)
+
+    gallery = FaceGallery(names, encodings, labels)
+    if cache_path is not None:
+        try:
+            gallery.save(cache_path, fingerprint)
+        except OSError as error:
+            # E.g. a read-only gallery directory: the gallery is simply encoded again next time
+            print(f"Warning: Could not cache the gallery at {cache_path}: {error}")
+    return gallery
+
+
+def load_gallery(gallery_dir=None, reference_image_paths=()):
+    """
+    Build the gallery of a gallery directory (cached in it), or of a single identity from reference images.
+    """
+    if gallery_dir is not None:
+        return build_gallery(list_gallery_images(gallery_dir), os.path.join(gallery_dir, CACHE_FILE))
+    name = os.path.splitext(os.path.basename(reference_image_paths[0]))[0]
+    return build_gallery({name: list(reference_image_paths)})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encode a gallery directory of reference images and cache it.")
+    parser.add_argument("--gallery_dir", type=str, required=True, help="Directory with one subdirectory (or image) per identity.")
+
+    args = parser.parse_args()
+
+    gallery = load_gallery(args.gallery_dir)
+    for i, name in enumerate(gallery.names):
+        print(f"{name}: {np.sum(gallery.labels == i)} reference encodings")
+    if os.path.exists(os.path.join(args.gallery_dir, CACHE_FILE)):
+        print(f"Gallery cached at {os.path.join(args.gallery_dir, CACHE_FILE)}")
@@ -0,0 +1,232 @@
+import cv2
+import os
+import json
+import argparse
+from tqdm import tqdm
+from detectors import create_detector
+from face_recog import identity_output_dir, match_faces
+from face_store import FaceDataWriter
+from gallery import load_gallery
+from scene_detection import SCENE_CUTS_FILE, SceneCutDetector, save_scene_cuts
+from segment_writer import create_segment_writer
+from smoothing import BoxSmoother
+
+
+class SegmentStream:
+    """
+    Write a matched segment to disk while it is still open.
+
+    Each box is smoothed online with a BoxSmoother as soon as its frame arrives, so every frame is
+    written right away and no decoded frames are held back. The output size is fixed by the first
+    box of the segment.
+
+    Args:
+        output_path (str): Path of the segment video file.
+        fps (float): Frame rate of the segment video.
+        backend (str): "opencv" or "ffmpeg" (see segment_writer.create_segment_writer).
+        audio_path (str): Video file to copy the segment's audio from (ffmpeg backend only), or None.
+    """
+
+    def __init__(self, output_path, fps, backend="opencv", audio_path=None):
+        self.output_path = output_path
+        self.fps = fps
+        self.backend = backend
+        self.audio_path = audio_path
+        self.smoother = BoxSmoother()
+        self.face_coordinates = []  # Smoothed (frame_index, box) pairs written so far
+        self.writer = None
+
+    @property
+    def last_frame(self):
+        return self.face_coordinates[-1][0]
+
+    def push(self, frame_index, frame, box):
+        x, y, w, h = self.smoother.update(box, (frame.shape[1], frame.shape[0]))
+        if self.writer is None:
+            # The segment length is not known yet, so the audio stops with the video
+            self.writer = create_segment_writer(self.output_path, self.fps, (w, h), self.backend,
+                                                self.audio_path, frame_index / self.fps)
+
+        self.writer.write(frame, (x, y, w, h))
+        self.face_coordinates.append((frame_index, (x, y, w, h)))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        return self.face_coordinates
+
+
+def run_pipeline(video_path, reference_image_path, output_dir, algorithm="retinaface",
+                 cascade_path="haarcascade_frontalface_default.xml", match_threshold=0.7,
+                 save_coordinates=False, debug=False, batch_size=1, output_format="npy", backend="opencv", audio=False,
+                 gallery_dir=None, detector=None, gallery=None):
+    """
+    Detect, recognize and crop the target faces in a single decode of the video.
+
+    Every frame is decoded once and passed through the detection, matching and segment writing
+    stages. No intermediate detection video is written; the face coordinates are optional.
+    Segments are closed at gaps in the matched frames and at scene cuts.
+
+    Args:
+        video_path (str): Path to the input video file.
+        reference_image_path (str or list): Path(s) to the reference images of the target face (unused with gallery_dir).
+        output_dir (str): Directory to save the video segments and metadata.
+        algorithm (str): The face detection algorithm to use ("haar" or "retinaface").
+        cascade_path (str): Path to the Haar Cascade XML file (used with Haar algorithm).
+        match_threshold (float): Threshold for face matching.
+        save_coordinates (bool): If True, also save the frame-wise face coordinates and scene cuts.
+        debug (bool): If True, print face distances and segment information.
+        batch_size (int): Number of frames passed through the detector at once.
+        output_format (str): Face coordinates format with save_coordinates: "npy", "json" or "both".
+        backend (str): Segment encoder, "opencv" or "ffmpeg".
+        audio (bool): If True, copy each segment's audio from the source (ffmpeg backend only).
+        gallery_dir (str): Gallery directory with the reference images of several targets (see gallery.py).
+        detector: Face detector to reuse across videos instead of creating one for `algorithm`.
+        gallery (FaceGallery): Reference gallery to reuse instead of loading the reference images.
+
+    Returns:
+        dict: Number of processed frames and of segments per identity, or None if the video could not be processed.
+    """
+    if detector is None:
+        detector = create_detector(algorithm, cascade_path)
+    if detector is None:
+        print("Error: Unsupported algorithm. Choose 'haar' or 'retinaface'.")
+        return
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print("Error: Cannot open video.")
+        return
+
+    os.makedirs(output_dir, exist_ok=True)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if gallery is None:
+        if isinstance(reference_image_path, str):
+            reference_image_path = [reference_image_path]
+        gallery = load_gallery(gallery_dir, reference_image_path)
+    if len(gallery) == 0:
+        print("Error: No face found in the reference images.")
+        cap.release()
+        return
+
+    face_writer = FaceDataWriter(output_dir, output_format) if save_coordinates else None
+    segments = [[] for _ in range(len(gallery))]
+    streams = {}  # identity -> open SegmentStream
+    scene_detector = SceneCutDetector()
+    frame_index = 0
+
+    with tqdm(total=total_frames, desc="Processing Video", unit="frame") as pbar:
+        while True:
+            frames = []
+            while len(frames) < batch_size:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frames.append(frame)
+            if not frames:
+                break
+
+            for frame, faces in zip(frames, detector.detect(frames)):
+                if face_writer is not None:
+                    face_writer.write(frame_index, faces)
+
+                if scene_detector.update(frame_index, frame):
+                    for identity in list(streams):
+                        segments[identity].append(streams.pop(identity).close())
+
+                matches = match_faces(frame, faces, gallery, match_threshold, frame_index, debug)
+                for identity, match in matches.items():
+                    # A gap in matched frames closes the current segment
+                    stream = streams.get(identity)
+                    if stream is not None and stream.last_frame != frame_index - 1:
+                        segments[identity].append(streams.pop(identity).close())
+                        stream = None
+                    if stream is None:
+                        identity_dir = identity_output_dir(output_dir, gallery, identity)
+                        os.makedirs(identity_dir, exist_ok=True)
+                        output_path = os.path.join(identity_dir, f"segment_{len(segments[identity]) + 1}.mp4")
+                        stream = streams[identity] = SegmentStream(output_path, fps, backend=backend, audio_path=video_path if audio else None)
+                    stream.push(frame_index, frame, match)
+
+                frame_index += 1
+                pbar.update(1)
+
+    for identity, stream in streams.items():
+        segments[identity].append(stream.close())
+    cap.release()
+
+    for identity, identity_segments in enumerate(segments):
+        identity_dir = identity_output_dir(output_dir, gallery, identity)
+        name = f" of {gallery.names[identity]}" if len(gallery) > 1 else ""
+        print(f"Detected {len(identity_segments)} face segments{name}:", [len(segment) for segment in identity_segments])
+
+        metadata = {'file_name': video_path, 'segments': []}
+        for segment in identity_segments:
+            metadata['segments'].append({
+                "start_time": segment[0][0] / fps,
+                "end_time": segment[-1][0] / fps,
+                "face_coordinates": segment
+            })
+
+        os.makedirs(identity_dir, exist_ok=True)
+        metadata_path = os.path.join(identity_dir, "metadata.json")
+        with open(metadata_path, "w") as file:
+            json.dump(metadata, file, indent=4)
+        print(f"Saved {len(identity_segments)} video segments and metadata to {identity_dir}")
+
+    if face_writer is not None:
+        face_writer.close()
+        save_scene_cuts(os.path.join(output_dir, SCENE_CUTS_FILE), scene_detector.scene_cuts, frame_index)
+        print(f"Face data saved to: {', '.join(face_writer.paths)}")
+
+    return {"frames": frame_index, "segments": {name: len(identity_segments) for name, identity_segments in zip(gallery.names, segments)}}
+
+
+def add_pipeline_arguments(parser):
+    """
+    Add the options of run_pipeline that pipeline.py and batch_runner.py share to an argparse parser.
+    """
+    parser.add_argument("--algorithm", type=str, default="retinaface", choices=["haar", "retinaface"], help="Face detection algorithm to use ('haar' or 'retinaface').")
+    parser.add_argument("--cascade_path", type=str, default="haarcascade_frontalface_default.xml", help="Path to the Haar Cascade XML file.")
+    parser.add_argument("--match_threshold", type=float, default=0.7, help="Threshold for face matching. Default is 0.7.")
+    parser.add_argument("--save_coordinates", action="store_true", help="Also save the frame-wise face coordinates and scene cuts.")
+    parser.add_argument("--output_format", type=str, default="npy", choices=["npy", "json", "both"], help="Face coordinates format with --save_coordinates: 'npy', 'json' or 'both'.")
+    parser.add_argument("--batch_size", type=int, default=1, help="Number of frames passed through the detector at once.")
+    parser.add_argument("--backend", type=str, default="opencv", choices=["opencv", "ffmpeg"], help="Segment encoder: OpenCV mp4v or an ffmpeg pipe with libx264.")
+    parser.add_argument("--audio", action="store_true", help="Copy the audio of each segment from the source video (requires --backend ffmpeg).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect, recognize and crop a target face in a single pass over a video.")
+    parser.add_argument("--video_path", type=str, required=True, help="Path to the input video file.")
+    references = parser.add_mutually_exclusive_group(required=True)
+    references.add_argument("--reference_image_path", type=str, nargs="+", help="Path to one or more reference images of the target face.")
+    references.add_argument("--gallery_dir", type=str, help="Directory with one subdirectory of reference images (or one image) per target.")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory to save the output video segments.")
+    add_pipeline_arguments(parser)
+    parser.add_argument("--debug", action="store_true", help="Enable debug mode to print face distances.")
+
+    args = parser.parse_args()
+    if args.audio and args.backend != "ffmpeg":
+        parser.error("--audio requires --backend ffmpeg")
+
+    run_pipeline(
+        video_path=args.video_path,
+        reference_image_path=args.reference_image_path,
+        output_dir=args.output_dir,
+        algorithm=args.algorithm,
+        cascade_path=args.cascade_path,
+        match_threshold=args.match_threshold,
+        save_coordinates=args.save_coordinates,
+        debug=args.debug,
+        batch_size=args.batch_size,
+        output_format=args.output_format,
+        backend=args.backend,
+        audio=args.audio,
+        gallery_dir=args.gallery_dir
+    )
+
+
+if __name__ == "__main__":
+    main()
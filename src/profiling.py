@@ -0,0 +1,41 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """
+    Accumulate the wall-clock time and number of calls of named pipeline stages, and named counters.
+
+    Usage:
+        timer = StageTimer()
+        with timer.stage("decode"):
+            ret, frame = cap.read()
+        timer.count("embeddings", len(encodings))
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def summary(self):
+        """
+        Return {"stages": {name: {"seconds", "calls"}}, "counters": {name: value}}.
+        """
+        return {
+            "stages": {name: {"seconds": self.seconds[name], "calls": self.calls[name]} for name in self.seconds},
+            "counters": dict(self.counters),
+        }
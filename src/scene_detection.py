@@ -0,0 +1,137 @@
+import os
+import json
+import argparse
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+# Scene cuts found during face detection, saved next to the face coordinates
+SCENE_CUTS_FILE = "scene_cuts.json"
+
+
+class SceneCutDetector:
+    """
+    Detect hard cuts between consecutive frames of a video from the frames as they are decoded.
+
+    Each frame is reduced to a tiny HSV thumbnail, and a cut is reported when the mean absolute
+    difference of hue, saturation and value to the previous frame exceeds `threshold`. The
+    thumbnail is taken from a strided view of the frame, so a frame costs about half a
+    millisecond at 1080p, a few percent of its decode time.
+
+    Args:
+        threshold (float): Lowest mean HSV difference (0-255 scale) reported as a cut.
+        min_scene_length (int): Minimum number of frames between two cuts, so that a fast
+            transition spread over a few frames is reported once.
+        size (tuple): (width, height) of the thumbnails that are compared.
+        scene_cuts (list): Cuts found earlier in the video, when continuing an interrupted run.
+    """
+
+    def __init__(self, threshold=27.0, min_scene_length=15, size=(64, 36), scene_cuts=()):
+        self.threshold = threshold
+        self.min_scene_length = min_scene_length
+        self.size = size
+        self.previous = None  # (frame_index, thumbnail) of the last frame
+        self.last_score = None  # Difference of the last frame to the one before it
+        self.scene_cuts = list(scene_cuts)
+
+    def thumbnail(self, frame):
+        height, width = frame.shape[:2]
+        # Skipping pixels before the area resize keeps the cost independent of the resolution
+        step = max(1, min(width // (4 * self.size[0]), height // (4 * self.size[1])))
+        small = cv2.resize(frame[::step, ::step], self.size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2HSV).astype(np.int16)
+
+    def score(self, previous_thumbnail, thumbnail):
+        """
+        Mean absolute HSV difference of two thumbnails, with hue compared on its 180 degree circle.
+        """
+        difference = np.abs(thumbnail - previous_thumbnail)
+        hue = np.minimum(difference[..., 0], 180 - difference[..., 0])
+        return float(hue.mean() + difference[..., 1].mean() + difference[..., 2].mean()) / 3
+
+    def update(self, frame_index, frame):
+        """
+        Add the next decoded frame and return True if a new scene starts at it.
+
+        Frames need not be contiguous: a frame is only compared with the previous one if that is
+        the frame right before it, so callers that skip frames only miss the cuts inside the gaps.
+        """
+        thumbnail = self.thumbnail(frame)
+        score = None
+        if self.previous is not None and self.previous[0] == frame_index - 1:
+            score = self.score(self.previous[1], thumbnail)
+        self.previous = (frame_index, thumbnail)
+        self.last_score = score
+        return self.add_score(frame_index, score)
+
+    def add_score(self, frame_index, score):
+        """
+        Decide whether a new scene starts at a frame from its difference `score` to the previous frame (None if unknown).
+        """
+        scene_cut = (score is not None and score > self.threshold
+                     and (not self.scene_cuts or frame_index - self.scene_cuts[-1] >= self.min_scene_length))
+        if scene_cut:
+            self.scene_cuts.append(frame_index)
+        return scene_cut
+
+
+def scene_cuts_path(face_coordinates_path):
+    """
+    Path of the scene cuts saved with the face coordinates at `face_coordinates_path` (store or JSON file).
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(face_coordinates_path)), SCENE_CUTS_FILE)
+
+
+def save_scene_cuts(path, scene_cuts, num_frames):
+    """
+    Save the first frame index of every scene after the first one.
+    """
+    with open(path + ".tmp", "w") as file:
+        json.dump({"num_frames": int(num_frames), "scene_cuts": sorted(int(frame_index) for frame_index in scene_cuts)}, file, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def load_scene_cuts(path):
+    """
+    Load the scene cuts saved at `path`, or return None if there are none.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        return json.load(file)["scene_cuts"]
+
+
+def detect_scene_cuts(video_path, threshold=27.0, min_scene_length=15):
+    """
+    Decode a whole video and return the frame indices where a new scene starts.
+    """
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    detector = SceneCutDetector(threshold, min_scene_length)
+    frame_index = 0
+    with tqdm(total=total_frames, desc="Detecting scene cuts", unit="frame") as pbar:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            detector.update(frame_index, frame)
+            frame_index += 1
+            pbar.update(1)
+    cap.release()
+    return detector.scene_cuts, frame_index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect the scene cuts of a video.")
+    parser.add_argument("--video_path", type=str, required=True, help="Path to the input video file.")
+    parser.add_argument("--output_path", type=str, help="Where to save the scene cuts as JSON.")
+    parser.add_argument("--threshold", type=float, default=27.0, help="Lowest mean HSV difference between two frames reported as a cut.")
+    parser.add_argument("--min_scene_length", type=int, default=15, help="Minimum number of frames between two cuts.")
+
+    args = parser.parse_args()
+
+    scene_cuts, num_frames = detect_scene_cuts(args.video_path, args.threshold, args.min_scene_length)
+    print(f"Found {len(scene_cuts)} scene cuts in {num_frames} frames:", scene_cuts)
+    if args.output_path:
+        save_scene_cuts(args.output_path, scene_cuts, num_frames)
+        print(f"Scene cuts saved to: {args.output_path}")
@@ -0,0 +1,146 @@
+import cv2
+import tempfile
+import subprocess
+import imageio_ffmpeg
+from tqdm import tqdm
+from frame_source import FrameReader
+
+
+def segment_size(segment):
+    """
+    Return the (width, height) of a segment's output video: the average box size over the segment.
+    """
+    final_w = sum([w for _, (_, _, w, _) in segment]) // len(segment)
+    final_h = sum([h for _, (_, _, _, h) in segment]) // len(segment)
+    return final_w, final_h
+
+
+class SegmentWriter:
+    """
+    Write the cropped face of each frame of a segment to a video file of a fixed size.
+
+    Args:
+        output_path (str): Path of the segment video file.
+        fps (float): Frame rate of the segment video.
+        size (tuple): (width, height) that every cropped face is resized to.
+    """
+
+    def __init__(self, output_path, fps, size):
+        self.output_path = output_path
+        self.size = size
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.writer = cv2.VideoWriter(output_path, fourcc, fps, size)
+
+    def write(self, frame, box):
+        x, y, w, h = box
+        cropped_face = frame[y:y+h, x:x+w]
+        if cropped_face.size:
+            self.writer.write(cv2.resize(cropped_face, self.size))
+
+    def close(self):
+        self.writer.release()
+
+
+class FfmpegSegmentWriter:
+    """
+    Pipe the cropped face of each frame of a segment into an ffmpeg process that encodes it with libx264.
+
+    The audio of the segment's time range is muxed from the source with stream copy, so the
+    source is neither re-decoded nor re-encoded and no temporary video files are written.
+    ffmpeg's messages go to a temporary file, so they cannot fill a pipe and block it.
+
+    Args:
+        output_path (str): Path of the segment video file.
+        fps (float): Frame rate of the segment video.
+        size (tuple): (width, height) that every cropped face is resized to.
+        audio_path (str): Video file to copy the audio from, or None for a silent segment.
+        start_time (float): Start of the segment in the audio source, in seconds.
+        duration (float): Length of the segment in seconds, or None to stop the audio with the video.
+    """
+
+    def __init__(self, output_path, fps, size, audio_path=None, start_time=0.0, duration=None):
+        self.output_path = output_path
+        self.size = size
+        command = [imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-hide_banner", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{size[0]}x{size[1]}", "-framerate", repr(float(fps)), "-i", "-"]
+        if audio_path is not None:
+            command += ["-ss", f"{start_time:.6f}"]
+            if duration is not None:
+                command += ["-t", f"{duration:.6f}"]
+            command += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0?", "-c:a", "copy"]
+            if duration is None:
+                command += ["-shortest"]
+        # yuv420p needs even dimensions
+        command += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-c:v", "libx264", "-pix_fmt", "yuv420p", output_path]
+        self.stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self.stderr)
+        self.failed = False
+
+    def write(self, frame, box):
+        x, y, w, h = box
+        cropped_face = frame[y:y+h, x:x+w]
+        if cropped_face.size and not self.failed:
+            try:
+                self.process.stdin.write(cv2.resize(cropped_face, self.size).tobytes())
+            except BrokenPipeError:
+                # ffmpeg exited early; the reason is reported once it has been waited for
+                self.failed = True
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            self.failed = True
+        if self.process.wait() != 0 or self.failed:
+            self.stderr.seek(0)
+            error = self.stderr.read().decode(errors="replace").strip()
+            print(f"Error: ffmpeg failed to write {self.output_path} (exit code {self.process.returncode}): {error}")
+        self.stderr.close()
+
+
+def create_segment_writer(output_path, fps, size, backend="opencv", audio_path=None, start_time=0.0, duration=None):
+    """
+    Open a segment writer for `backend`: "opencv" (mp4v, no audio) or "ffmpeg" (libx264, audio from `audio_path`).
+    """
+    if backend == "ffmpeg":
+        return FfmpegSegmentWriter(output_path, fps, size, audio_path, start_time, duration)
+    return SegmentWriter(output_path, fps, size)
+
+
+def write_segments(video_path, segments, output_paths, fps, backend="opencv", audio=False):
+    """
+    Write several segments of a video in a single sequential decode of the source.
+
+    A writer is opened when the first frame of a segment is reached and closed after its last
+    frame, so only the segments that overlap the current frame are open at a time.
+
+    Args:
+        video_path (str): Path to the source video file.
+        segments (list): Segments as lists of (frame_index, (x, y, w, h)) in frame order.
+        output_paths (list): Output video path of each segment.
+        fps (float): Frame rate of the segment videos.
+        backend (str): "opencv" or "ffmpeg" (see create_segment_writer).
+        audio (bool): If True, copy each segment's audio from the source (ffmpeg backend only).
+    """
+    frame_boxes = {}  # frame_index -> [(segment index, box)]
+    for s, segment in enumerate(segments):
+        for frame_index, box in segment:
+            frame_boxes.setdefault(frame_index, []).append((s, box))
+
+    video_capture = FrameReader(video_path)
+    writers = {}
+
+    for frame_index in tqdm(sorted(frame_boxes), desc="Saving video segments"):
+        ret, frame = video_capture.read(frame_index)
+        for s, box in frame_boxes[frame_index]:
+            if s not in writers:
+                start_frame, end_frame = segments[s][0][0], segments[s][-1][0]
+                writers[s] = create_segment_writer(output_paths[s], fps, segment_size(segments[s]), backend,
+                                                   video_path if audio else None, start_frame / fps,
+                                                   (end_frame - start_frame + 1) / fps)
+            if ret:
+                writers[s].write(frame, box)
+            if frame_index == segments[s][-1][0]:
+                writers.pop(s).close()
+
+    video_capture.release()
@@ -0,0 +1,108 @@
+import numpy as np
+
+# Constant-velocity motion model of each box coordinate, one frame per step
+TRANSITION = np.array([[1.0, 1.0], [0.0, 1.0]])
+# Covariance of a random acceleration per frame, scaled by the process noise variance
+PROCESS_COVARIANCE = np.array([[0.25, 0.5], [0.5, 1.0]])
+
+
+def clamp_box(box, frame_size):
+    """
+    Move an (x, y, w, h) box inside a frame of (width, height) `frame_size`, shrinking it only if it is larger than the frame.
+    """
+    x, y, w, h = box
+    frame_width, frame_height = frame_size
+    w, h = min(w, frame_width), min(h, frame_height)
+    return min(max(x, 0), frame_width - w), min(max(y, 0), frame_height - h), w, h
+
+
+class BoxSmoother:
+    """
+    Online smoothing of the (x, y, w, h) boxes of a segment with a constant-velocity Kalman filter.
+
+    All four coordinates are filtered at once as independent position/velocity states. Each call
+    to update() returns the smoothed box of the frame just added, so a segment can be written while
+    it is still open. The filter starts from the first box and never looks outside the segment, so
+    the boxes at its edges are not pulled towards zero as with a zero-padded moving average.
+
+    The noise levels are relative to the face size, so the same settings suit small and large faces.
+    As the filter can overshoot when a face stops moving, the returned boxes are kept inside the frame.
+
+    Args:
+        process_noise (float): Standard deviation of the per-frame change in velocity, as a fraction of the face size.
+        measurement_noise (float): Standard deviation of the detector's box jitter, as a fraction of the face size.
+    """
+
+    def __init__(self, process_noise=0.01, measurement_noise=0.05):
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.state = None  # (4, 2) position and velocity of x, y, w, h
+        self.covariance = None  # (4, 2, 2)
+        self.predicted = None  # (state, covariance) predicted for the last frame before its measurement
+
+    def update(self, box, frame_size=None):
+        """
+        Add the measured box of the next frame and return the smoothed (x, y, w, h) box as ints.
+
+        Args:
+            box (tuple): The measured (x, y, w, h) box.
+            frame_size (tuple): (width, height) of the frame the returned box is kept inside, or None.
+        """
+        measurement = np.asarray(box, dtype=np.float64)
+        size = np.sqrt(max(measurement[2] * measurement[3], 1.0))
+        measurement_variance = (self.measurement_noise * size) ** 2
+
+        if self.state is None:
+            self.state = np.stack([measurement, np.zeros(4)], axis=1)
+            self.covariance = np.zeros((4, 2, 2))
+            self.covariance[:, 0, 0] = self.covariance[:, 1, 1] = measurement_variance
+            self.predicted = None
+        else:
+            # Predict
+            self.state = self.state @ TRANSITION.T
+            self.covariance = TRANSITION @ self.covariance @ TRANSITION.T + PROCESS_COVARIANCE * (self.process_noise * size) ** 2
+            self.predicted = (self.state, self.covariance)
+            # Correct with the measured position of each coordinate
+            gain = self.covariance[:, :, 0] / (self.covariance[:, 0, 0] + measurement_variance)[:, None]
+            self.state = self.state + gain * (measurement - self.state[:, 0])[:, None]
+            self.covariance = self.covariance - gain[:, :, None] * self.covariance[:, 0, None, :]
+
+        return to_box(self.state[:, 0], frame_size)
+
+
+def to_box(position, frame_size=None):
+    x, y, w, h = position
+    box = int(x), int(y), max(int(w), 1), max(int(h), 1)
+    return box if frame_size is None else clamp_box(box, frame_size)
+
+
+def smooth_segment(segment, frame_size=None, **smoother_options):
+    """
+    Smooth the boxes of a finished segment of (frame_index, (x, y, w, h)) pairs.
+
+    The segment is run forward through a BoxSmoother and then backward with a Rauch-Tung-Striebel
+    pass, so every box also uses the frames after it and does not lag behind the face.
+
+    Args:
+        segment (list): (frame_index, (x, y, w, h)) pairs in frame order.
+        frame_size (tuple): (width, height) of the frames the smoothed boxes are kept inside, or None.
+        **smoother_options: Noise levels of the BoxSmoother.
+    """
+    smoother = BoxSmoother(**smoother_options)
+    filtered, predicted = [], []
+    for _, box in segment:
+        smoother.update(box)
+        filtered.append((smoother.state, smoother.covariance))
+        predicted.append(smoother.predicted)
+
+    state = filtered[-1][0]
+    states = [state]
+    for k in range(len(segment) - 2, -1, -1):
+        filtered_state, filtered_covariance = filtered[k]
+        predicted_state, predicted_covariance = predicted[k + 1]
+        gain = filtered_covariance @ TRANSITION.T @ np.linalg.inv(predicted_covariance)
+        state = filtered_state + (gain @ (state - predicted_state)[:, :, None])[:, :, 0]
+        states.append(state)
+    states.reverse()
+
+    return [(frame_index, to_box(state[:, 0], frame_size)) for (frame_index, _), state in zip(segment, states)]
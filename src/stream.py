@@ -0,0 +1,348 @@
+import sys
+import json
+import bisect
+import time
+import queue
+import argparse
+import threading
+import cv2
+import numpy as np
+from detectors import create_detector
+from face_encoder import encode_chips, face_chip
+from face_recog import select_matches
+from gallery import load_gallery
+from scene_detection import SceneCutDetector
+from tracking import IouTracker
+
+# Marks the end of the stream in the stage queues
+END_OF_STREAM = None
+# Seconds to wait for the capture thread to stop before giving up on a source that does not respond
+CAPTURE_JOIN_TIMEOUT = 2.0
+
+
+def put_dropping_oldest(stage_queue, item):
+    """
+    Put `item` into a bounded queue, discarding the oldest queued items while it is full.
+
+    Returns:
+        int: Number of discarded items.
+    """
+    dropped = 0
+    while True:
+        try:
+            stage_queue.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                stage_queue.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass
+
+
+def latency_stats(latencies):
+    """
+    Summarize latencies in seconds as {"mean", "p50", "p95", "max"} in milliseconds.
+    """
+    if len(latencies) == 0:
+        return None
+    latencies = np.asarray(latencies) * 1000
+    return {"mean": float(latencies.mean()), "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)), "max": float(latencies.max())}
+
+
+def open_source(source):
+    """
+    Open a cv2.VideoCapture on a device index ("0"), a file, or a stream URL (rtsp://, http://, udp://, ...).
+    """
+    return cv2.VideoCapture(int(source) if source.isdigit() else source)
+
+
+class StreamProcessor:
+    """
+    Detect, track and recognize target faces on a live video source with bounded latency.
+
+    Capture, detection and recognition run as concurrent threads connected by bounded queues.
+    When a stage falls behind, the oldest queued frames are dropped instead of letting the delay
+    grow, so the latency stays bounded by the queue sizes. Scene cuts are detected on every
+    captured frame, before any is dropped. Faces are linked into tracks and only a few frames per
+    track are encoded (like face_recog.py --track); the other frames of a track inherit its match.
+
+    Matched segments are reported as JSON line events through `emit`:
+        segment_start: identity, frame, time and box of the first matched frame.
+        segment_end: identity, first and last frame and time, number of matched frames and their latency.
+        stats: frame rate, dropped frames and latency of the frames since the previous stats event.
+        end: total captured, processed and dropped frames and the overall frame rate.
+        frame (with frame_events): faces and matches of every processed frame.
+
+    Args:
+        source (str): Device index, file path or stream URL (see open_source).
+        gallery (FaceGallery): Reference gallery of the targets.
+        detector: Face detector from detectors.create_detector.
+        emit (callable): Called with each event dict.
+        match_threshold (float): Threshold for face matching.
+        queue_size (int): Capacity of each queue between stages.
+        drop_frames (bool): If False, stages wait for each other instead of dropping frames (for files).
+        max_gap (int): Number of processed frames a segment or track survives without a match.
+        sample_interval (int): Processed frames between recognized samples of a track.
+        max_samples (int): Maximum number of recognized samples per track.
+        stats_interval (float): Seconds between two stats events.
+        max_frames (int): Stop after this many captured frames, or None to run until the source ends.
+        frame_events (bool): If True, also emit a frame event for every processed frame.
+    """
+
+    def __init__(self, source, gallery, detector, emit, match_threshold=0.7, queue_size=4, drop_frames=True, max_gap=5,
+                 sample_interval=30, max_samples=3, stats_interval=5.0, max_frames=None, frame_events=False):
+        self.source = source
+        self.gallery = gallery
+        self.detector = detector
+        self.emit = emit
+        self.match_threshold = match_threshold
+        self.drop_frames = drop_frames
+        self.max_gap = max_gap
+        self.sample_interval = sample_interval
+        self.max_samples = max_samples
+        self.stats_interval = stats_interval
+        self.max_frames = max_frames
+        self.frame_events = frame_events
+
+        self.detect_queue = queue.Queue(queue_size)
+        self.recognize_queue = queue.Queue(queue_size)
+        self.stop_event = threading.Event()
+        self.dropped = {"detect": 0, "recognize": 0}
+        self.num_captured = 0
+        self.num_processed = 0
+        self.start_time = None
+        self.error = None
+
+        self.scene_detector = SceneCutDetector()  # Updated by the capture thread
+        self.tracker = IouTracker(max_gap=max_gap)
+        self.track_distances = {}  # track_id -> distances of the encoded samples to each identity
+        self.open_segments = {}  # identity -> open segment state
+        self.window = {"frames": 0, "latencies": [], "detect": [], "recognize": [], "start": None}
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        """
+        Process the source until it ends, `max_frames` frames have been captured or stop() is called.
+        """
+        cap = open_source(self.source)
+        if not cap.isOpened():
+            print(f"Error: Cannot open video source {self.source}.", file=sys.stderr)
+            return
+        self.start_time = self.window["start"] = time.perf_counter()
+        # The capture thread can block in cap.read() on a stalled network source, so it must not keep the process alive
+        capture_thread = threading.Thread(target=self._capture, args=(cap,), name="capture", daemon=True)
+        detect_thread = threading.Thread(target=self._detect, name="detect")
+        capture_thread.start()
+        detect_thread.start()
+        try:
+            self._recognize()
+        except KeyboardInterrupt:
+            print("Stopping.", file=sys.stderr)
+        finally:
+            self.stop_event.set()
+            detect_thread.join()
+            capture_thread.join(CAPTURE_JOIN_TIMEOUT)
+            if capture_thread.is_alive():
+                # Releasing the source under a blocked read is unsafe; it is closed when the process exits
+                print("Warning: The video source did not respond; leaving it open.", file=sys.stderr)
+            else:
+                cap.release()
+
+        for identity in list(self.open_segments):
+            self._close_segment(identity)
+        self._emit_stats()
+        elapsed = time.perf_counter() - self.start_time
+        self.emit({"event": "end", "time": elapsed, "captured": self.num_captured, "processed": self.num_processed,
+                   "dropped": dict(self.dropped), "fps": self.num_processed / elapsed if elapsed > 0 else 0.0})
+        if self.error is not None:
+            raise self.error
+
+    def _put(self, stage_queue, item, stage):
+        if self.drop_frames:
+            self.dropped[stage] += put_dropping_oldest(stage_queue, item)
+            return
+        while not self.stop_event.is_set():
+            try:
+                stage_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, stage_queue):
+        while True:
+            try:
+                return stage_queue.get(timeout=0.1)
+            except queue.Empty:
+                if self.stop_event.is_set():
+                    return END_OF_STREAM
+
+    def _capture(self, cap):
+        try:
+            frame_index = 0
+            while not self.stop_event.is_set() and (self.max_frames is None or frame_index < self.max_frames):
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                captured = time.perf_counter()
+                self.scene_detector.update(frame_index, frame)
+                self._put(self.detect_queue, {"frame_index": frame_index, "frame": frame, "captured": captured}, "detect")
+                frame_index += 1
+                self.num_captured = frame_index
+        except Exception as error:
+            self.error = error
+        finally:
+            self._put(self.detect_queue, END_OF_STREAM, "detect")
+
+    def _detect(self):
+        try:
+            while True:
+                item = self._get(self.detect_queue)
+                if item is END_OF_STREAM:
+                    break
+                start = time.perf_counter()
+                item["faces"] = self.detector.detect([item["frame"]])[0]
+                item["detect_seconds"] = time.perf_counter() - start
+                self._put(self.recognize_queue, item, "recognize")
+        except Exception as error:
+            self.error = error
+            self.stop_event.set()
+        finally:
+            self._put(self.recognize_queue, END_OF_STREAM, "recognize")
+
+    def _recognize(self):
+        previous_frame = -1
+        while True:
+            item = self._get(self.recognize_queue)
+            if item is END_OF_STREAM:
+                break
+            start = time.perf_counter()
+            frame_index, frame, faces = item["frame_index"], item["frame"], item["faces"]
+            # A cut in a dropped frame since the previous processed frame also counts
+            scene_cuts = self.scene_detector.scene_cuts
+            scene_cut = bisect.bisect_right(scene_cuts, frame_index) > bisect.bisect_right(scene_cuts, previous_frame)
+            previous_frame = frame_index
+            boxes = [(face["x"], face["y"], face["width"], face["height"]) for face in faces]
+            # Tracks and segments count processed frames, so dropped frames do not end them
+            step = self.num_processed
+            tracks = self.tracker.update(step, boxes, scene_cut)
+
+            # Only the sampled faces of each track are encoded, all in one batch
+            samples = [(face, track) for face, track in zip(faces, tracks) if track.needs_sample(self.sample_interval, self.max_samples)]
+            if samples:
+                encodings = encode_chips([face_chip(frame, face) for face, _ in samples])
+                for (_, track), distances in zip(samples, self.gallery.distances(encodings)):
+                    track.num_samples += 1
+                    self.track_distances.setdefault(track.track_id, []).append(distances)
+
+            scored_faces = [(box, np.median(self.track_distances[track.track_id], axis=0))
+                            for box, track in zip(boxes, tracks) if track.track_id in self.track_distances]
+            matches = select_matches(scored_faces, self.match_threshold)
+            done = time.perf_counter()
+            latency = done - item["captured"]
+            self._update_segments(frame_index, step, item["captured"], matches, latency, scene_cut)
+
+            self.num_processed += 1
+            self.window["frames"] += 1
+            self.window["latencies"].append(latency)
+            self.window["detect"].append(item["detect_seconds"])
+            self.window["recognize"].append(done - start)
+            if self.frame_events:
+                self.emit({"event": "frame", "frame": frame_index, "time": item["captured"] - self.start_time,
+                           "faces": [list(box) for box in boxes], "scene_cut": scene_cut,
+                           "matches": {self.gallery.names[identity]: list(box) for identity, box in matches.items()},
+                           "latency_ms": latency * 1000})
+            if done - self.window["start"] >= self.stats_interval:
+                self._emit_stats()
+
+    def _update_segments(self, frame_index, step, captured, matches, latency, scene_cut):
+        # A segment ends at a scene cut or after max_gap processed frames without a match
+        for identity in list(self.open_segments):
+            if scene_cut or step - self.open_segments[identity]["end_step"] > self.max_gap + (identity in matches):
+                self._close_segment(identity)
+
+        for identity, box in matches.items():
+            segment = self.open_segments.get(identity)
+            if segment is None:
+                segment = self.open_segments[identity] = {"start_frame": frame_index, "start_time": captured - self.start_time,
+                                                          "frames": 0, "latencies": []}
+                self.emit({"event": "segment_start", "identity": self.gallery.names[identity], "frame": frame_index,
+                           "time": segment["start_time"], "box": list(box)})
+            segment["end_frame"] = frame_index
+            segment["end_step"] = step
+            segment["end_time"] = captured - self.start_time
+            segment["frames"] += 1
+            segment["latencies"].append(latency)
+
+    def _close_segment(self, identity):
+        segment = self.open_segments.pop(identity)
+        self.emit({"event": "segment_end", "identity": self.gallery.names[identity],
+                   "start_frame": segment["start_frame"], "end_frame": segment["end_frame"],
+                   "start_time": segment["start_time"], "end_time": segment["end_time"],
+                   "frames": segment["frames"], "latency_ms": latency_stats(segment["latencies"])})
+
+    def _emit_stats(self):
+        now = time.perf_counter()
+        elapsed = now - self.window["start"]
+        self.emit({"event": "stats", "time": now - self.start_time,
+                   "captured": self.num_captured, "processed": self.num_processed, "dropped": dict(self.dropped),
+                   "fps": self.window["frames"] / elapsed if elapsed > 0 else 0.0,
+                   "latency_ms": latency_stats(self.window["latencies"]),
+                   "detect_ms": latency_stats(self.window["detect"]),
+                   "recognize_ms": latency_stats(self.window["recognize"])})
+        self.window = {"frames": 0, "latencies": [], "detect": [], "recognize": [], "start": now}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect and recognize target faces on a live video source and emit matched segments as JSON lines.")
+    parser.add_argument("--source", type=str, required=True, help="Camera index (e.g. 0), video file, or stream URL (rtsp://, http://, udp://).")
+    references = parser.add_mutually_exclusive_group(required=True)
+    references.add_argument("--reference_image_path", type=str, nargs="+", help="Path to one or more reference images of the target face.")
+    references.add_argument("--gallery_dir", type=str, help="Directory with one subdirectory of reference images (or one image) per target.")
+    parser.add_argument("--events_path", type=str, default=None, help="File to append the JSON line events to. Default is stdout.")
+    parser.add_argument("--algorithm", type=str, default="retinaface", choices=["haar", "retinaface"], help="Face detection algorithm to use ('haar' or 'retinaface').")
+    parser.add_argument("--cascade_path", type=str, default="haarcascade_frontalface_default.xml", help="Path to the Haar Cascade XML file.")
+    parser.add_argument("--match_threshold", type=float, default=0.7, help="Threshold for face matching. Default is 0.7.")
+    parser.add_argument("--queue_size", type=int, default=4, help="Capacity of the queues between stages. Default is 4.")
+    parser.add_argument("--no_drop", action="store_true", help="Process every frame instead of dropping frames when a stage falls behind (for files).")
+    parser.add_argument("--max_gap", type=int, default=5, help="Frames a segment survives without a match. Default is 5.")
+    parser.add_argument("--sample_interval", type=int, default=30, help="Processed frames between recognized samples of a track. Default is 30.")
+    parser.add_argument("--max_samples", type=int, default=3, help="Maximum number of recognized samples per track. Default is 3.")
+    parser.add_argument("--stats_interval", type=float, default=5.0, help="Seconds between two stats events. Default is 5.")
+    parser.add_argument("--max_frames", type=int, default=None, help="Stop after this many captured frames.")
+    parser.add_argument("--frame_events", action="store_true", help="Also emit an event for every processed frame.")
+
+    args = parser.parse_args()
+
+    gallery = load_gallery(args.gallery_dir, args.reference_image_path)
+    if len(gallery) == 0:
+        print("Error: No face found in the reference images.", file=sys.stderr)
+        return
+    detector = create_detector(args.algorithm, args.cascade_path)
+
+    output = open(args.events_path, "a") if args.events_path else sys.stdout
+    lock = threading.Lock()
+
+    def emit(event):
+        with lock:
+            output.write(json.dumps(event) + "\n")
+            output.flush()
+
+    processor = StreamProcessor(args.source, gallery, detector, emit, args.match_threshold, args.queue_size, not args.no_drop,
+                                args.max_gap, args.sample_interval, args.max_samples, args.stats_interval, args.max_frames,
+                                args.frame_events)
+    try:
+        processor.run()
+    except KeyboardInterrupt:
+        # The stages are stopped and the open segments closed by run()
+        pass
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import cv2
+import numpy as np
+
+
+def box_iou(box_a, box_b):
+    """
+    Intersection over union of two (x, y, w, h) boxes.
+    """
+    ax, ay, aw, ah = box_a
+    bx, by, bw, bh = box_b
+    inter_w = min(ax + aw, bx + bw) - max(ax, bx)
+    inter_h = min(ay + ah, by + bh) - max(ay, by)
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    intersection = inter_w * inter_h
+    return intersection / float(aw * ah + bw * bh - intersection)
+
+
+class Track:
+    """
+    A face followed across frames.
+
+    Args:
+        track_id (int): Unique identifier of the track.
+        frame_index (int): First frame of the track.
+        box (tuple): (x, y, w, h) box in the first frame.
+    """
+
+    def __init__(self, track_id, frame_index, box):
+        self.track_id = track_id
+        self.last_frame = frame_index
+        self.last_box = box
+        self.length = 1
+        self.num_samples = 0  # Frames of the track queued for recognition
+
+    def extend(self, frame_index, box):
+        self.last_frame = frame_index
+        self.last_box = box
+        self.length += 1
+
+    def needs_sample(self, sample_interval, max_samples):
+        """
+        Whether the current frame of the track should be sent to recognition.
+
+        The first frame is always sampled, then every `sample_interval` frames until
+        `max_samples` frames have been sampled.
+        """
+        return self.num_samples < max_samples and (self.length - 1) % sample_interval == 0
+
+
+class IouTracker:
+    """
+    Link per-frame face boxes into tracks by greedy IoU matching with the previous boxes.
+
+    Args:
+        iou_threshold (float): Minimum IoU for a box to continue a track.
+        max_gap (int): Number of frames a track survives without a matching box.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_gap=5):
+        self.iou_threshold = iou_threshold
+        self.max_gap = max_gap
+        self.active_tracks = []
+        self.next_id = 0
+
+    def update(self, frame_index, boxes, scene_cut=False):
+        """
+        Assign the boxes of a frame to tracks, starting new tracks for unmatched boxes.
+
+        Args:
+            frame_index (int): Index of the frame, increasing between calls.
+            boxes (list): (x, y, w, h) boxes detected in the frame.
+            scene_cut (bool): If True, no track continues across this frame.
+
+        Returns:
+            list: The Track of each box, in the order of `boxes`.
+        """
+        if scene_cut:
+            self.active_tracks = []
+        self.active_tracks = [track for track in self.active_tracks
+                              if frame_index - track.last_frame <= self.max_gap + 1]
+
+        candidates = []
+        for t, track in enumerate(self.active_tracks):
+            for b, box in enumerate(boxes):
+                iou = box_iou(track.last_box, box)
+                if iou >= self.iou_threshold:
+                    candidates.append((iou, t, b))
+
+        assigned = [None] * len(boxes)
+        used_tracks = set()
+        for _, t, b in sorted(candidates, reverse=True):
+            if t in used_tracks or assigned[b] is not None:
+                continue
+            used_tracks.add(t)
+            assigned[b] = self.active_tracks[t]
+            assigned[b].extend(frame_index, boxes[b])
+
+        for b, box in enumerate(boxes):
+            if assigned[b] is None:
+                assigned[b] = Track(self.next_id, frame_index, box)
+                self.next_id += 1
+                self.active_tracks.append(assigned[b])
+
+        return assigned
+
+
+class OpticalFlowBoxTracker:
+    """
+    Move face boxes from one frame to the next with sparse Lucas-Kanade optical flow.
+
+    Corner features are picked inside each box, tracked forward and checked backward, and each box
+    is shifted by the median displacement of its reliable features. The returned boxes are clipped
+    to the frame, and a box that has mostly left the frame is dropped.
+
+    Args:
+        max_points (int): Maximum number of features tracked per box.
+        max_error (float): Maximum forward-backward error in pixels for a feature to be kept.
+        min_points (int): Minimum number of reliable features for a box to count as tracked.
+        min_visible (float): Minimum fraction of a box's area inside the frame for it to be kept.
+    """
+
+    def __init__(self, max_points=40, max_error=1.0, min_points=5, min_visible=0.5):
+        self.max_points = max_points
+        self.max_error = max_error
+        self.min_points = min_points
+        self.min_visible = min_visible
+        self.gray = None
+        self.boxes = []
+        self.points = []
+        self.start_counts = []  # Number of features of each box when tracking started
+
+    def start(self, frame, boxes):
+        """
+        Restart tracking from detected (x, y, w, h) boxes in `frame`.
+        """
+        self.gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.boxes = [tuple(box) for box in boxes]
+        self.points = [self._find_points(box) for box in self.boxes]
+        self.start_counts = [0 if box_points is None else len(box_points) for box_points in self.points]
+
+    def update(self, frame):
+        """
+        Track the boxes into `frame`.
+
+        Returns:
+            tuple: (boxes, confidence), where confidence is the lowest fraction of the features
+            found at start() that are still reliable, over all boxes (1.0 when there is nothing to track).
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        frame_height, frame_width = gray.shape
+        boxes, points, start_counts, visible_boxes, confidence = [], [], [], [], 1.0
+
+        for box, box_points, start_count in zip(self.boxes, self.points, self.start_counts):
+            if box_points is None or len(box_points) < self.min_points:
+                return [], 0.0
+
+            forward, status, _ = cv2.calcOpticalFlowPyrLK(self.gray, gray, box_points, None)
+            backward, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.gray, forward, None)
+            error = np.linalg.norm((box_points - backward).reshape(-1, 2), axis=1)
+            good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < self.max_error)
+
+            # Measured against the features found at start(), so that slow drift over many frames also lowers it
+            confidence = min(confidence, good.sum() / start_count)
+            if good.sum() < self.min_points:
+                return [], 0.0
+
+            dx, dy = np.median((forward - box_points).reshape(-1, 2)[good], axis=0)
+            x, y, w, h = box
+            x, y = int(round(x + dx)), int(round(y + dy))
+            x0, y0, x1, y1 = max(x, 0), max(y, 0), min(x + w, frame_width), min(y + h, frame_height)
+            if max(x1 - x0, 0) * max(y1 - y0, 0) < self.min_visible * w * h:
+                continue
+            # The unclipped box keeps being tracked, so a face that comes back into view keeps its size
+            boxes.append((x, y, w, h))
+            points.append(forward[good].reshape(-1, 1, 2))
+            start_counts.append(start_count)
+            visible_boxes.append((x0, y0, x1 - x0, y1 - y0))
+
+        self.gray, self.boxes, self.points, self.start_counts = gray, boxes, points, start_counts
+        return visible_boxes, confidence
+
+    def _find_points(self, box):
+        x, y, w, h = box
+        mask = np.zeros_like(self.gray)
+        mask[max(y, 0):y + h, max(x, 0):x + w] = 255
+        return cv2.goodFeaturesToTrack(self.gray, self.max_points, qualityLevel=0.01, minDistance=5, mask=mask)